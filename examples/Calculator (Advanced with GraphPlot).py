@@ -1,194 +1,168 @@
 import sys
 import os
 import json
-import math
+import time
 import numpy as np
-import sympy as sp
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QLocale
+from PyQt6.QtCore import Qt, QObject, QTimer, pyqtSignal, QLocale
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QLineEdit, QPushButton, QGridLayout,
-    QLabel, QVBoxLayout, QHBoxLayout, QSlider, QGroupBox, QSplitter
+    QLabel, QVBoxLayout, QHBoxLayout, QSlider, QGroupBox, QSplitter, QCheckBox
 )
 from PyQt6.QtGui import QIntValidator, QDoubleValidator
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg
-from matplotlib.collections import LineCollection
-import matplotlib.colors as mcolors
+from calculator_engine import (
+    get_appdata_folder, evaluate_expression, decimate_minmax, decimate_uniform, evaluate_symbolic,
+    split_expressions, evaluate_graph_batch, is_surface, is_implicit, implicit_curve, analyze_graph,
+    free_parameters, parametric_expression, PARAMETER_POINTS, INTEGRAL_TOLERANCE, SampleTileCache, SurfaceTileCache,
+    LatestJobPool, JobCancelled, symbolic_pool
+)
 
 # ---------------- Appdata Setup ----------------
 
-def get_appdata_folder():
-    if os.name == 'nt':
-        base_dir = os.getenv('APPDATA')
-        folder = os.path.join(base_dir, "UltraAdvancedCalculator")
-    else:
-        home = os.path.expanduser("~")
-        folder = os.path.join(home, ".ultra_advanced_calculator")
-    if not os.path.exists(folder):
-        os.makedirs(folder)
-    return folder
-
 STATE_FILE = os.path.join(get_appdata_folder(), "state.json")
-
-# ---------------- Advanced Calculation Functions ----------------
-
-def diff_func(expr, var='x'):
-    try:
-        var_sym = sp.symbols(var)
-        return str(sp.diff(sp.sympify(expr), var_sym))
-    except Exception:
-        return "Error"
-
-def integrate_func(expr, var='x'):
-    try:
-        var_sym = sp.symbols(var)
-        return str(sp.integrate(sp.sympify(expr), var_sym))
-    except Exception:
-        return "Error"
-
-def simplify_func(expr):
-    try:
-        return str(sp.simplify(sp.sympify(expr)))
-    except Exception:
-        return "Error"
-
-def factor_func(expr):
-    try:
-        return str(sp.factor(sp.sympify(expr)))
-    except Exception:
-        return "Error"
-
-def expand_func(expr):
+REPLOT_DEBOUNCE_MS = 30  # Delay after the last slider move before re-plotting
+# Curves that can be drawn over f: symbolic operation -> (checkbox label, color)
+OVERLAYS = {"diff": ("f'", "#ffb000"), "integrate": ("\u222bf", "#00e0a0")}
+BATCH_POINTS_PER_PIXEL = 8  # Shared grid density when several functions are plotted
+SERIES_COLORS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
+                 "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"]
+ANALYSIS_SHOWN = 4  # Roots and extrema listed under the plot; all of them are marked on it
+PARAMETER_STEPS = 100  # Parameter slider positions per unit; the sliders span -10 to 10
+
+# ---------------- Background Jobs ----------------
+
+def calculation_job(expression, token):
     try:
-        return str(sp.expand(sp.sympify(expr)))
+        return evaluate_expression(expression)
     except Exception:
         return "Error"
 
-# Allowed names for direct evaluation
-ALLOWED_NAMES = {
-    "sin": math.sin,
-    "cos": math.cos,
-    "tan": math.tan,
-    "asin": math.asin,
-    "acos": math.acos,
-    "atan": math.atan,
-    "sinh": math.sinh,
-    "cosh": math.cosh,
-    "tanh": math.tanh,
-    "log": math.log,
-    "log10": math.log10,
-    "exp": math.exp,
-    "sqrt": math.sqrt,
-    "factorial": math.factorial,
-    "pi": math.pi,
-    "e": math.e,
-    "abs": abs,
-    "round": round,
-    "pow": pow,
-    # Symbolic functions:
-    "diff": diff_func,
-    "integrate": integrate_func,
-    "simplify": simplify_func,
-    "factorize": factor_func,
-    "expand": expand_func
-}
-
-# Allowed names for graph evaluation using numpy
-ALLOWED_NAMES_GRAPH = {
-    "sin": np.sin,
-    "cos": np.cos,
-    "tan": np.tan,
-    "arcsin": np.arcsin,
-    "arccos": np.arccos,
-    "arctan": np.arctan,
-    "sinh": np.sinh,
-    "cosh": np.cosh,
-    "tanh": np.tanh,
-    "log": np.log,
-    "log10": np.log10,
-    "exp": np.exp,
-    "sqrt": np.sqrt,
-    "pi": np.pi,
-    "e": np.e,
-    "abs": np.abs,
-    "round": np.round,
-    "power": np.power,
-    "np": np
-}
-
-# ---------------- Thread Classes ----------------
-
-class EvaluationThread(QThread):
-    result_signal = pyqtSignal(object)
-
-    def __init__(self, expression, allowed_names):
-        super().__init__()
-        self.expression = expression
-        self.allowed_names = allowed_names
-
-    def run(self):
+def graph_job(expression, lower, upper, sample_cache, pixel_width, overlays, token):
+    # Returns a list of (x, y) series, the overlay curves of the first one and its analysis
+    expressions = split_expressions(expression) or [expression]
+    if len(expressions) > 1:
+        # Several functions share one grid and are evaluated in a single parallel batch;
+        # overlays are only drawn for a single function
+        x = np.linspace(lower, upper, pixel_width * BATCH_POINTS_PER_PIXEL)
+        ys = evaluate_graph_batch(expressions, x)
+        token.check()
+        return "curves", [decimate_minmax(x, y, pixel_width) for y in ys], {}, None
+    # Dense samples where the curve bends, then at most a few points per pixel column
+    x, y = sample_cache.sample(expression, lower, upper, token.check)
+    # Roots, extrema and the integral start from the dense samples, before they are thinned out
+    analysis = analyze_graph(expression, x, y, lower, upper)
+    x, y = decimate_minmax(x, y, pixel_width)
+    # Overlays are evaluated on f's grid; their symbolic form and compiled code are cached
+    curves = {}
+    for operation in overlays:
         try:
-            expr = self.expression.replace("^", "**")
-            result = eval(expr, {"__builtins__": None}, self.allowed_names)
+            curves[operation] = evaluate_symbolic(operation, expression, x)
+        except JobCancelled:
+            raise
         except Exception:
-            result = "Error"
-        self.result_signal.emit(result)
-
-class GraphThread(QThread):
-    plot_signal = pyqtSignal(np.ndarray, np.ndarray)
-    error_signal = pyqtSignal(str)
-
-    def __init__(self, expression, lower, upper, num_points=1000):
-        super().__init__()
-        self.expression = expression
-        self.lower = lower
-        self.upper = upper
-        self.num_points = num_points
-
-    def run(self):
-        try:
-            x = np.linspace(self.lower, self.upper, self.num_points)
-            expr = self.expression.replace("^", "**")
-            local_dict = {"x": x}
-            local_dict.update(ALLOWED_NAMES_GRAPH)
-            y = eval(expr, {"__builtins__": None}, local_dict)
-            if not isinstance(y, np.ndarray):
-                y = np.full_like(x, y)
-            self.plot_signal.emit(x, y)
-        except Exception as e:
-            self.error_signal.emit("Error: " + str(e))
-
-# ---------------- Gradient Line Plotting ----------------
-
-def gradient_line(ax, x, y, cmap_name="viridis"):
+            curves[operation] = None  # e.g. no closed-form integral; f is still drawn
+    return "curves", [(x, y)], curves, analysis
+
+def parametric_job(expression, lower, upper, pixel_width, values, token):
+    # A whole number of samples per pixel column, so the uniform grid can be decimated by reshaping
+    pixel_width = max(pixel_width, 1)
+    num_points = pixel_width * max(PARAMETER_POINTS // pixel_width, 1)
+    x, y = parametric_expression(expression).evaluate(lower, upper, values, num_points)
+    return "curves", [decimate_uniform(x, y, pixel_width)], {}, None
+
+def surface_job(expression, lower, upper, surface_cache, pixel_width, pixel_height, token):
+    # f(x, y) over lower..upper on both axes, built from cached tiles
+    image, extent = surface_cache.render(expression, (lower, upper), (lower, upper),
+                                         pixel_width, pixel_height, token.check)
+    return "surface", image, extent
+
+def implicit_job(expression, lower, upper, pixel_width, pixel_height, token):
+    # The curve of an equation over lower..upper on both axes, refined to about a pixel
+    segments = implicit_curve(expression, (lower, upper), (lower, upper),
+                              max(pixel_width, pixel_height), checkpoint=token.check)
+    return "implicit", segments, (lower, upper, lower, upper)
+
+class JobSignals(QObject):
+    # Emitted from the worker threads, delivered on the GUI thread
+    done = pyqtSignal(object, object)
+
+# ---------------- Plot Helpers ----------------
+
+def y_limits(y):
     """
-    Plot a line with a gradient color.
+    Vertical range for the plot. Near poles adaptive sampling finds huge values,
+    so when a few outliers dominate the range the bulk of the curve is shown instead.
     """
-    # Create line segments for coloring
-    points = np.array([x, y]).T.reshape(-1, 1, 2)
-    segments = np.concatenate([points[:-1], points[1:]], axis=1)
-    norm = plt.Normalize(x.min(), x.max())
-    cmap = plt.get_cmap(cmap_name)
-    lc = LineCollection(segments, cmap=cmap, norm=norm)
-    # Set the values used for colormapping
-    lc.set_array(x)
-    lc.set_linewidth(2)
-    line = ax.add_collection(lc)
-    ax.autoscale_view()
-    return line
-
-# We need to import pyplot from matplotlib here for normalization and colormaps.
-import matplotlib.pyplot as plt
+    finite = y[np.isfinite(y)]
+    if len(finite) == 0:
+        return None
+    low, high = finite.min(), finite.max()
+    bulk_low, bulk_high = np.percentile(finite, [1, 99])
+    if high - low > 20 * (bulk_high - bulk_low):
+        margin = (bulk_high - bulk_low) * 0.5
+        low, high = bulk_low - margin, bulk_high + margin
+    if low == high:
+        low, high = low - 1, high + 1
+    return low, high
+
+def fill_polygons(x, y):
+    # The area between the curve and y=0 like fill_between draws it: one polygon per run of finite samples
+    finite = np.concatenate([[False], np.isfinite(x) & np.isfinite(y), [False]])
+    edges = np.flatnonzero(np.diff(finite.astype(np.int8)))
+    return [np.column_stack([np.concatenate([x[start:stop], x[start:stop][::-1]]),
+                             np.concatenate([y[start:stop], np.zeros(stop - start)])])
+            for start, stop in zip(edges[::2], edges[1::2])]
+
+def fits_within(inner, outer):
+    # inner lies within outer and still fills at least half of it
+    return outer[0] <= inner[0] and inner[1] <= outer[1] and inner[1] - inner[0] >= (outer[1] - outer[0]) / 2
+
+def format_values(values):
+    values = [f"{value:.6g}" for value in values]
+    if len(values) > ANALYSIS_SHOWN:
+        values = values[:ANALYSIS_SHOWN] + [f"... ({len(values)} in total)"]
+    return ", ".join(values) or "none"
+
+def format_analysis(analysis, lower, upper):
+    # One line of text under the plot
+    if analysis is None:
+        return ""
+    integral, error = analysis["integral"], analysis["integral_error"]
+    converged = error <= INTEGRAL_TOLERANCE * analysis["integral_scale"]
+    if not np.isfinite(integral):
+        integral = "undefined"
+    elif abs(integral) <= error:
+        # Cancels out, e.g. an odd function over a symmetric range; what's left is rounding
+        integral = "0" if converged else f"0 \u00b1 {error:.1g}"
+    elif not converged:
+        # Digits down to the leading digit of the error estimate
+        digits = int(np.floor(np.log10(max(abs(integral), error))) - np.floor(np.log10(error))) + 1
+        digits = min(max(digits, 1), 10)
+        integral = f"{integral:.{digits}g} \u00b1 {error:.1g}"
+    else:
+        integral = f"{integral:.10g}"
+    return (f"Roots: {format_values(analysis['roots'])}   "
+            f"Min: {format_values(analysis['minima'][0])}   "
+            f"Max: {format_values(analysis['maxima'][0])}   "
+            f"\u222b[{lower:g}, {upper:g}] = {integral}")
 
 # ---------------- Calculator and Graph Integrated Widget ----------------
 
 class IntegratedCalculator(QWidget):
     def __init__(self):
         super().__init__()
-        self.eval_thread = None
-        self.graph_thread = None
+        # One pool for all calculations and plots, only the newest job per channel is shown
+        self.jobs = LatestJobPool()
+        self.job_signals = JobSignals()
+        self.job_signals.done.connect(self.on_job_done)
+        self.sample_cache = SampleTileCache()  # Reused while panning and zooming
+        self.surface_cache = SurfaceTileCache()
+        self.has_graph = False
+        self.last_graph = None  # (x, y) currently shown
+        self.frame_start = None  # Set when a new graph arrives, used to measure the frame time
+        self.canvas = None  # matplotlib is loaded by init_plot once the window is on screen
         self.init_ui()
         self.load_state()
+        self.first_paint_done = False  # finish_startup runs after the window is drawn once
 
     def init_ui(self):
         self.setWindowTitle("Ultra Advanced Scientific Calculator")
@@ -298,7 +272,8 @@ class IntegratedCalculator(QWidget):
 
         # Function expression field (pre-filled from calc_input if possible)
         self.graph_expr = QLineEdit()
-        self.graph_expr.setPlaceholderText("Enter function f(x), e.g., sin(x)+x^2")
+        self.graph_expr.setPlaceholderText("f(x), e.g. sin(x)+x^2 (several separated by ;), f(x, y) for a heatmap, "
+                                           "or an equation like x^2+y^2=1")
         # Boundary fields and sliders in a horizontal layout
         bound_layout = QHBoxLayout()
 
@@ -324,6 +299,14 @@ class IntegratedCalculator(QWidget):
         self.lower_field.editingFinished.connect(self.sync_lower_slider)
         self.upper_field.editingFinished.connect(self.sync_upper_slider)
 
+        # Update the graph live while the bounds change, once the slider pauses
+        self.replot_timer = QTimer(self)
+        self.replot_timer.setSingleShot(True)
+        self.replot_timer.setInterval(REPLOT_DEBOUNCE_MS)
+        self.replot_timer.timeout.connect(self.replot_live)
+        self.lower_slider.valueChanged.connect(lambda _: self.replot_timer.start())
+        self.upper_slider.valueChanged.connect(lambda _: self.replot_timer.start())
+
         bound_layout.addWidget(QLabel("Lower:"))
         bound_layout.addWidget(self.lower_field)
         bound_layout.addWidget(self.lower_slider)
@@ -331,21 +314,54 @@ class IntegratedCalculator(QWidget):
         bound_layout.addWidget(self.upper_field)
         bound_layout.addWidget(self.upper_slider)
 
+        # A slider per free parameter of the expression (a, b, ... besides x), built by plot_function
+        self.parameter_layout = QGridLayout()
+        self.parameter_rows = {}  # name -> (name label, slider, value label)
+        self.parameter_values = {}  # Kept when the expression changes, so a and b keep their values
+
         # Plot button for the graph group
         self.graph_plot_btn = QPushButton("Plot")
         self.graph_plot_btn.clicked.connect(self.plot_function)
 
-        # Matplotlib Figure and Canvas
-        self.figure = Figure(facecolor="#3e3e3e")
-        self.canvas = FigureCanvasQTAgg(self.figure)
-        self.ax = self.figure.add_subplot(111)
-        self.setup_plot_aesthetics()
+        # The hatched fill is the most expensive part of a frame, so it can be switched off
+        self.hatch_checkbox = QCheckBox("Hatch fill")
+        self.hatch_checkbox.setChecked(True)
+        self.hatch_checkbox.toggled.connect(self.toggle_fill)
+        self.frame_label = QLabel("")
+
+        # Derivative and antiderivative drawn over f
+        self.overlay_checkboxes = {}
+        for operation, (label, color) in OVERLAYS.items():
+            checkbox = QCheckBox(label)
+            checkbox.setStyleSheet(f"color: {color};")
+            checkbox.toggled.connect(self.replot_live)
+            self.overlay_checkboxes[operation] = checkbox
+
+        plot_layout = QHBoxLayout()
+        plot_layout.addWidget(self.graph_plot_btn)
+        plot_layout.addWidget(self.hatch_checkbox)
+        for checkbox in self.overlay_checkboxes.values():
+            plot_layout.addWidget(checkbox)
+        plot_layout.addWidget(self.frame_label)
+
+        # Roots, extrema and the integral of the plotted function
+        self.analysis_label = QLabel("")
+        self.analysis_label.setWordWrap(True)
+        self.analysis_label.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+
+        # Stands in for the matplotlib canvas until init_plot replaces it
+        self.plot_placeholder = QLabel("Loading plot...")
+        self.plot_placeholder.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.plot_placeholder.setMinimumHeight(300)
 
         graph_layout.addWidget(self.graph_expr)
         graph_layout.addLayout(bound_layout)
-        graph_layout.addWidget(self.graph_plot_btn)
-        graph_layout.addWidget(self.canvas)
+        graph_layout.addLayout(self.parameter_layout)
+        graph_layout.addLayout(plot_layout)
+        graph_layout.addWidget(self.analysis_label)
+        graph_layout.addWidget(self.plot_placeholder)
         graph_group.setLayout(graph_layout)
+        self.graph_layout = graph_layout
 
         # ---------------- Main Layout ----------------
         main_layout = QVBoxLayout()
@@ -360,12 +376,61 @@ class IntegratedCalculator(QWidget):
         self.setLayout(main_layout)
         self.resize(800, 900)
 
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.first_paint_done:
+            self.first_paint_done = True
+            QTimer.singleShot(0, self.finish_startup)
+
+    def finish_startup(self):
+        # Runs once the window is on screen: the workers load sympy in their own
+        # processes while matplotlib is imported here
+        symbolic_pool.start()
+        self.init_plot()
+
+    def init_plot(self):
+        # Importing matplotlib takes longer than building the rest of the window,
+        # so it happens after the first paint (or on the first plot, if that is sooner)
+        if self.canvas is not None:
+            return
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg
+        self.figure = Figure(facecolor="#3e3e3e")
+        self.canvas = FigureCanvasQTAgg(self.figure)
+        self.ax = self.figure.add_subplot(111)
+        self.setup_plot_aesthetics()
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+        self.graph_layout.replaceWidget(self.plot_placeholder, self.canvas)
+        self.plot_placeholder.deleteLater()
+
     def setup_plot_aesthetics(self):
+        from matplotlib.image import AxesImage
+        from matplotlib.collections import PolyCollection
         self.ax.clear()
         self.ax.set_facecolor("#2e2e2e")
         self.ax.tick_params(colors='white')
         for spine in self.ax.spines.values():
             spine.set_color('white')
+        # Artists are created once and updated in place. The curves and fill are animated:
+        # full redraws skip them and they are blitted over a cached background instead.
+        self.series_collections = []  # One LineCollection per function, added as needed
+        # Heatmap for expressions in x and y; add_image, unlike imshow, leaves the limits alone
+        self.surface_image = AxesImage(self.ax, cmap="viridis", origin="lower", interpolation="nearest",
+                                       animated=True, visible=False)
+        self.ax.add_image(self.surface_image)
+        # Hatched area under the curve, its polygons are replaced with set_verts on every update
+        self.fill = PolyCollection([], facecolor="none", hatch="///", edgecolor="cyan", alpha=0.2,
+                                   animated=True, visible=False)
+        self.ax.add_collection(self.fill, autolim=False)
+        self.overlay_lines = {}
+        for operation, (label, color) in OVERLAYS.items():
+            self.overlay_lines[operation], = self.ax.plot([], [], color=color, linewidth=1.5, animated=True)
+        # Roots and extrema found by the analysis
+        self.analysis_markers, = self.ax.plot([], [], linestyle="none", marker="o", markersize=5,
+                                              color="white", animated=True, visible=False)
+        self.message_text = self.ax.text(0.5, 0.5, "", horizontalalignment='center',
+                                         verticalalignment='center', transform=self.ax.transAxes, color='white')
+        self.background = None
         self.figure.tight_layout()
 
     # ---------------- Calculator Methods ----------------
@@ -387,9 +452,24 @@ class IntegratedCalculator(QWidget):
     def calculate_expression(self):
         expr = self.calc_input.text()
         self.calc_result.setText("Calculating...")
-        self.eval_thread = EvaluationThread(expr, ALLOWED_NAMES)
-        self.eval_thread.result_signal.connect(self.display_calc_result)
-        self.eval_thread.start()
+        self.jobs.submit("calc", calculation_job, expr, on_done=self.job_signals.done.emit)
+
+    def on_job_done(self, token, result):
+        # A newer job may have been submitted while this result was on its way
+        if token.cancelled():
+            return
+        if token.channel == "calc":
+            self.display_calc_result(result)
+        elif isinstance(result, Exception):
+            self.display_graph_error("Error: " + str(result))
+        else:
+            kind, *data = result
+            if kind == "surface":
+                self.update_surface(*data)
+            elif kind == "implicit":
+                self.update_implicit(*data)
+            else:
+                self.update_graph(*data)
 
     def display_calc_result(self, result):
         self.calc_result.setText(str(result))
@@ -423,51 +503,248 @@ class IntegratedCalculator(QWidget):
             pass
 
     def plot_function(self):
+        self.init_plot()
         expr = self.graph_expr.text()
         try:
             lower = float(self.lower_field.text())
             upper = float(self.upper_field.text())
         except ValueError:
-            self.ax.clear()
-            self.ax.text(0.5, 0.5, "Invalid boundaries", horizontalalignment='center',
-                         verticalalignment='center', transform=self.ax.transAxes, color='white')
-            self.canvas.draw()
+            self.show_message("Invalid boundaries")
             return
-        self.ax.clear()
-        self.ax.text(0.5, 0.5, "Calculating...", horizontalalignment='center',
-                     verticalalignment='center', transform=self.ax.transAxes, color='white')
-        self.canvas.draw()
-        self.graph_thread = GraphThread(expr, lower, upper)
-        self.graph_thread.plot_signal.connect(self.update_graph)
-        self.graph_thread.error_signal.connect(self.display_graph_error)
-        self.graph_thread.start()
-
-    def update_graph(self, x, y):
-        self.ax.clear()
-        # Create a colorful gradient line using a colormap
-        segments = np.array([x, y]).T.reshape(-1, 1, 2)
-        segments = np.concatenate([segments[:-1], segments[1:]], axis=1)
-        norm = plt.Normalize(x.min(), x.max())
-        cmap = plt.get_cmap("plasma")
-        lc = LineCollection(segments, cmap=cmap, norm=norm)
-        lc.set_array(x)
-        lc.set_linewidth(3)
-        line = self.ax.add_collection(lc)
-        self.ax.set_xlim(x.min(), x.max())
-        self.ax.set_ylim(np.nanmin(y), np.nanmax(y))
-        self.ax.set_facecolor("#2e2e2e")
-        self.ax.tick_params(colors='white')
-        for spine in self.ax.spines.values():
-            spine.set_color('white')
-        # Optionally, add a gradient fill under the curve
-        self.ax.fill_between(x, y, color="none", hatch="///", edgecolor="cyan", alpha=0.2)
-        self.canvas.draw()
+        if not self.has_graph:
+            # Otherwise the current graph stays visible until the new one is ready
+            self.show_message("Calculating...")
+        pixel_width = int(self.canvas.width() * self.canvas.devicePixelRatioF())
+        pixel_height = int(self.canvas.height() * self.canvas.devicePixelRatioF())
+        parameters = () if is_surface(expr) else free_parameters(expr)
+        self.update_parameter_sliders(parameters)
+        if parameters:
+            # Every slider move lands here; the pool drops settings that are already outdated
+            values = {name: self.parameter_values[name] for name in parameters}
+            self.jobs.submit("graph", parametric_job, expr, lower, upper, pixel_width, values,
+                             on_done=self.job_signals.done.emit)
+            return
+        if is_implicit(expr):
+            self.jobs.submit("graph", implicit_job, expr, lower, upper, pixel_width, pixel_height,
+                             on_done=self.job_signals.done.emit)
+            return
+        if is_surface(expr):
+            self.jobs.submit("graph", surface_job, expr, lower, upper, self.surface_cache, pixel_width,
+                             pixel_height, on_done=self.job_signals.done.emit)
+            return
+        overlays = [operation for operation, checkbox in self.overlay_checkboxes.items() if checkbox.isChecked()]
+        self.jobs.submit("graph", graph_job, expr, lower, upper, self.sample_cache, pixel_width, overlays,
+                         on_done=self.job_signals.done.emit)
+
+    def update_parameter_sliders(self, parameters):
+        if tuple(self.parameter_rows) == parameters:
+            return
+        for widgets in self.parameter_rows.values():
+            for widget in widgets:
+                self.parameter_layout.removeWidget(widget)
+                widget.deleteLater()
+        self.parameter_rows = {}
+        for row, name in enumerate(parameters):
+            value = self.parameter_values.setdefault(name, 1.0)
+            slider = QSlider(Qt.Orientation.Horizontal)
+            slider.setRange(-10 * PARAMETER_STEPS, 10 * PARAMETER_STEPS)
+            slider.setValue(round(value * PARAMETER_STEPS))
+            value_label = QLabel(f"{value:g}")
+            slider.valueChanged.connect(lambda position, name=name: self.on_parameter_changed(name, position))
+            self.parameter_rows[name] = (QLabel(f"{name}:"), slider, value_label)
+            for column, widget in enumerate(self.parameter_rows[name]):
+                self.parameter_layout.addWidget(widget, row, column)
+
+    def on_parameter_changed(self, name, position):
+        value = position / PARAMETER_STEPS
+        self.parameter_values[name] = value
+        self.parameter_rows[name][2].setText(f"{value:g}")
+        # Re-plotted right away rather than debounced: only the parameter-dependent part is recomputed
+        self.replot_live()
+
+    def replot_live(self):
+        if self.has_graph and self.graph_expr.text():
+            self.plot_function()
+
+    def series_collection(self, index):
+        from matplotlib.collections import LineCollection
+        while len(self.series_collections) <= index:
+            collection = LineCollection([], cmap="plasma", animated=True)
+            self.ax.add_collection(collection)
+            self.series_collections.append(collection)
+        return self.series_collections[index]
+
+    def update_graph(self, series, curves, analysis):
+        self.frame_start = time.perf_counter()
+        full_redraw = self.message_text.get_visible()
+        self.has_graph = True
+        x, y = self.last_graph = series[0]
+        self.message_text.set_visible(False)
+        self.surface_image.set_visible(False)
+        for index, (sx, sy) in enumerate(series):
+            # Update the segments of the existing collection
+            collection = self.series_collection(index)
+            points = np.column_stack([sx, sy])
+            collection.set_segments(np.stack([points[:-1], points[1:]], axis=1))
+            if len(series) == 1:
+                # Colorful gradient line
+                collection.set_array(sx[:-1])
+                collection.set_clim(sx.min(), sx.max())
+                collection.set_linewidth(3)
+            else:
+                collection.set_array(None)
+                collection.set_color(SERIES_COLORS[index % len(SERIES_COLORS)])
+                collection.set_linewidth(2)
+            collection.set_visible(True)
+        for collection in self.series_collections[len(series):]:
+            collection.set_visible(False)
+        self.update_fill()
+        for operation, line in self.overlay_lines.items():
+            curve = curves.get(operation)
+            if curve is not None:
+                line.set_data(x, curve)
+            line.set_visible(curve is not None)
+        self.update_analysis(analysis, x.min(), x.max())
+
+        xlim = (x.min(), x.max())
+        ylim = y_limits(np.concatenate([sy for sx, sy in series])) or self.ax.get_ylim()
+        if self.parameter_rows:
+            # While a parameter slider moves, the axes stay put unless the curve outgrows them,
+            # so the frames are blitted instead of redrawing the ticks every time
+            if fits_within(ylim, self.ax.get_ylim()):
+                ylim = self.ax.get_ylim()
+            else:
+                margin = (ylim[1] - ylim[0]) * 0.1
+                ylim = (ylim[0] - margin, ylim[1] + margin)
+        if xlim != self.ax.get_xlim() or ylim != self.ax.get_ylim():
+            # New limits mean new ticks, which needs a full redraw
+            self.ax.set_xlim(*xlim)
+            self.ax.set_ylim(*ylim)
+            full_redraw = True
+        self.refresh_graph(full_redraw)
+
+    def update_surface(self, image, extent):
+        self.frame_start = time.perf_counter()
+        full_redraw = self.message_text.get_visible()
+        self.has_graph = True
+        self.last_graph = None
+        self.message_text.set_visible(False)
+        for artist in self.series_collections + list(self.overlay_lines.values()):
+            artist.set_visible(False)
+        self.update_analysis(None, 0, 0)
+        self.update_fill()
+
+        xlim, ylim = extent[:2], extent[2:]
+        if xlim != self.ax.get_xlim() or ylim != self.ax.get_ylim():
+            full_redraw = True
+        # One image artist, updated in place; the color range ignores a few extreme values
+        self.surface_image.set_data(image)
+        self.surface_image.set_extent(extent)
+        self.surface_image.set_clim(*(y_limits(image[::4, ::4].ravel()) or (0, 1)))
+        self.surface_image.set_visible(True)
+        self.ax.set_xlim(*xlim)
+        self.ax.set_ylim(*ylim)
+        self.refresh_graph(full_redraw)
+
+    def update_implicit(self, segments, extent):
+        self.frame_start = time.perf_counter()
+        full_redraw = self.message_text.get_visible()
+        self.has_graph = True
+        self.last_graph = None
+        self.message_text.set_visible(False)
+        self.surface_image.set_visible(False)
+        for artist in self.series_collections[1:] + list(self.overlay_lines.values()):
+            artist.set_visible(False)
+        self.update_analysis(None, 0, 0)
+        self.update_fill()
+        # The segments from marching squares go straight into one collection
+        collection = self.series_collection(0)
+        collection.set_segments(segments)
+        collection.set_array(None)
+        collection.set_color(SERIES_COLORS[0])
+        collection.set_linewidth(2)
+        collection.set_visible(True)
+
+        xlim, ylim = extent[:2], extent[2:]
+        if xlim != self.ax.get_xlim() or ylim != self.ax.get_ylim():
+            self.ax.set_xlim(*xlim)
+            self.ax.set_ylim(*ylim)
+            full_redraw = True
+        self.refresh_graph(full_redraw)
+
+    def update_analysis(self, analysis, lower, upper):
+        self.analysis_label.setText(format_analysis(analysis, lower, upper))
+        if analysis is None:
+            self.analysis_markers.set_visible(False)
+            return
+        roots = analysis["roots"]
+        (min_x, min_y), (max_x, max_y) = analysis["minima"], analysis["maxima"]
+        self.analysis_markers.set_data(np.concatenate([roots, min_x, max_x]),
+                                       np.concatenate([np.zeros_like(roots), min_y, max_y]))
+        self.analysis_markers.set_visible(True)
+
+    def update_fill(self):
+        visible = self.has_graph and self.last_graph is not None and self.hatch_checkbox.isChecked()
+        if visible:
+            self.fill.set_verts(fill_polygons(*self.last_graph))
+        self.fill.set_visible(visible)
+
+    def toggle_fill(self):
+        if self.has_graph:
+            self.frame_start = time.perf_counter()
+            self.update_fill()
+            self.refresh_graph(False)
+
+    def refresh_graph(self, full_redraw):
+        if full_redraw or self.background is None:
+            # on_draw saves the new background and paints the curve on top
+            self.canvas.draw_idle()
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_curve()
+            self.canvas.blit(self.ax.bbox)
+            self.record_frame_time()
+
+    def on_draw(self, event):
+        # Called after every full redraw, including resizes
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.draw_curve()
+        self.record_frame_time()
+
+    def draw_curve(self):
+        if self.surface_image.get_visible():
+            self.ax.draw_artist(self.surface_image)
+        if self.fill.get_visible():
+            self.ax.draw_artist(self.fill)
+        for collection in self.series_collections:
+            if collection.get_visible():
+                self.ax.draw_artist(collection)
+        for line in self.overlay_lines.values():
+            if line.get_visible():
+                self.ax.draw_artist(line)
+        if self.analysis_markers.get_visible():
+            self.ax.draw_artist(self.analysis_markers)
+
+    def record_frame_time(self):
+        if self.frame_start is not None:
+            self.frame_label.setText(f"Frame: {(time.perf_counter() - self.frame_start) * 1000:.1f} ms")
+            self.frame_start = None
+
+    def show_message(self, message):
+        self.has_graph = False
+        self.surface_image.set_visible(False)
+        for collection in self.series_collections:
+            collection.set_visible(False)
+        for line in self.overlay_lines.values():
+            line.set_visible(False)
+        self.update_analysis(None, 0, 0)
+        self.update_fill()
+        self.message_text.set_text(message)
+        self.message_text.set_visible(True)
+        self.canvas.draw_idle()
 
     def display_graph_error(self, message):
-        self.ax.clear()
-        self.ax.text(0.5, 0.5, message, horizontalalignment='center',
-                     verticalalignment='center', transform=self.ax.transAxes, color='white')
-        self.canvas.draw()
+        self.show_message(message)
 
     # ---------------- State Persistence ----------------
 
@@ -480,6 +757,7 @@ class IntegratedCalculator(QWidget):
                 self.graph_expr.setText(state.get("graph_expression", ""))
                 self.lower_field.setText(str(state.get("graph_lower", "-10")))
                 self.upper_field.setText(str(state.get("graph_upper", "10")))
+                self.parameter_values = {name: float(value) for name, value in state.get("parameters", {}).items()}
                 # Sync sliders with field values
                 self.sync_lower_slider()
                 self.sync_upper_slider()
@@ -504,6 +782,7 @@ class IntegratedCalculator(QWidget):
             state["graph_upper"] = float(self.upper_field.text())
         except Exception:
             state["graph_upper"] = 10
+        state["parameters"] = self.parameter_values
         try:
             with open(STATE_FILE, "w") as f:
                 json.dump(state, f)
@@ -512,6 +791,8 @@ class IntegratedCalculator(QWidget):
 
     def closeEvent(self, event):
         self.save_state()
+        self.jobs.shutdown()
+        symbolic_pool.shutdown()
         event.accept()
 
 # ---------------- Main Application ----------------
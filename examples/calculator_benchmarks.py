@@ -0,0 +1,316 @@
+import os
+import sys
+import ast
+import time
+import subprocess
+import timeit
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from calculator_engine import (
+    ALLOWED_NAMES, ALLOWED_NAMES_GRAPH, evaluate_expression, evaluate_graph, evaluate_graph_chunked,
+    evaluate_graph_batch, run_symbolic, lambdify_expression, symbolic_pool, evaluate_surface,
+    evaluate_surface_tiled, SurfaceTileCache, implicit_expression, implicit_curve, marching_squares,
+    ParametricExpression, normalize_expression, optimize_expression, GRAPH_BACKENDS, graph_kernels
+)
+from calculator_cli import run_batch
+
+# Run all benchmarks:  python calculator_benchmarks.py
+# Run a single one:    python calculator_benchmarks.py compile
+# The startup benchmark opens the calculator window; set QT_QPA_PLATFORM=offscreen on a headless machine.
+
+CALC_EXPRESSIONS = ["sin(pi/2)+3^2", "sqrt(2)*exp(1)-log(10)", "factorial(10)/pow(2, 8)"]
+GRAPH_EXPRESSIONS = ["sin(x)+x^2", "exp(-x^2)*cos(3*x)", "tanh(x)/(1+abs(x))"]
+
+
+def report(name, baseline, optimized, unit="evaluations/s"):
+    print(f"  {name:32} {baseline:12.0f} -> {optimized:12.0f} {unit}  ({optimized / baseline:.1f}x)")
+
+
+def rate(func, number):
+    return number / min(timeit.repeat(func, number=number, repeat=3))
+
+
+def bench_compile():
+    print("Compiled expression cache vs eval of the raw string")
+    for expr in CALC_EXPRESSIONS:
+        raw = lambda: eval(expr.replace("^", "**"), {"__builtins__": None}, ALLOWED_NAMES)
+        report(expr, rate(raw, 20000), rate(lambda: evaluate_expression(expr), 20000))
+
+    # Small arrays, like slider-driven re-evaluation, where parsing dominates
+    x = np.linspace(-10, 10, 100)
+    for expr in GRAPH_EXPRESSIONS:
+        def raw():
+            local_dict = {"x": x}
+            local_dict.update(ALLOWED_NAMES_GRAPH)
+            return eval(expr.replace("^", "**"), {"__builtins__": None}, local_dict)
+        report(expr + " (100 points)", rate(raw, 5000), rate(lambda: evaluate_graph(expr, x), 5000))
+
+
+def array_passes(tree):
+    # Operations that go over a whole array: those using x or a named subexpression
+    return sum(1 for node in ast.walk(tree) if isinstance(node, (ast.BinOp, ast.UnaryOp, ast.Call))
+               and any(isinstance(name, ast.Name) and (name.id == "x" or name.id.startswith("_t"))
+                       for name in ast.walk(node)))
+
+
+def bench_optimize(num_points=2_000_000):
+    # The compiler's optimizer (constant folding, repeated subexpressions, in-place temporaries)
+    # against the same expression compiled as written
+    expressions = ["sin(x)^2 + cos(x)^2 + sin(x)*exp(2*pi)",
+                   "exp(-x^2/(2*pi))*cos(x) + exp(-x^2/(2*pi))*sin(x)",
+                   "sqrt(abs(x))*log(2)/pi + sqrt(abs(x))^3"] + GRAPH_EXPRESSIONS
+    x = np.linspace(-100, 100, num_points)
+    print(f"Optimized vs literal evaluation over {num_points:,} points (array passes, time, peak memory)")
+    for expr in expressions:
+        tree = ast.parse(normalize_expression(expr), mode="eval")
+        literal = compile(tree, "<literal>", "eval")
+        passes = array_passes(tree), array_passes(optimize_expression(ast.parse(normalize_expression(expr),
+                                                                                mode="eval")))
+        evaluate_graph(expr, x)  # compile outside the measurement
+        with np.errstate(all="ignore"):
+            (baseline, baseline_peak), (optimized, optimized_peak) = (
+                min((measure(lambda: eval(literal, {"__builtins__": None, **ALLOWED_NAMES_GRAPH}, {"x": x}))
+                     for _ in range(3))),
+                min((measure(lambda: evaluate_graph(expr, x)) for _ in range(3))))
+        print(f"  {expr:50} {passes[0]:3} -> {passes[1]:3} passes  {baseline * 1000:6.0f} -> {optimized * 1000:6.0f} ms"
+              f"  {baseline_peak / 2**20:6.1f} -> {optimized_peak / 2**20:6.1f} MiB")
+
+
+def measure(func):
+    # Wall time and peak traced memory (numpy reports its allocations to tracemalloc)
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_chunked(num_points=10_000_000):
+    expr = "exp(-x^2/50)*sin(3*x)+sqrt(abs(x))"
+    x = np.linspace(-100, 100, num_points)
+    out = np.empty_like(x)
+    print(f"Chunked evaluation of {expr} over {num_points:,} points (x is allocated beforehand)")
+    elapsed, peak = measure(lambda: evaluate_graph(expr, x))
+    print(f"  {'whole array':20} {elapsed * 1000:8.0f} ms  peak {peak / 2**20:8.1f} MiB")
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        with ThreadPoolExecutor(workers) as executor:
+            evaluate_graph_chunked(expr, x, out, executor=executor)  # warm up the threads
+            elapsed, peak = measure(lambda: evaluate_graph_chunked(expr, x, out, executor=executor))
+        print(f"  {f'{workers} thread(s)':20} {elapsed * 1000:8.0f} ms  peak {peak / 2**20:8.1f} MiB")
+        workers *= 2
+
+
+def bench_batch(num_functions=20, num_points=1_000_000):
+    # A family of curves, as typed into the plotter separated by ';'
+    expressions = [f"{k / 4}*sin(x)^2 + cos(x)*exp(-x^2/50) + {k}" for k in range(num_functions)]
+    x = np.linspace(-10, 10, num_points)
+    print(f"{num_functions} functions over {num_points:,} shared points")
+
+    def separate():
+        for expr in expressions:
+            evaluate_graph(expr, x)
+    baseline = num_functions / min(timeit.repeat(separate, number=1, repeat=3))
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        with ThreadPoolExecutor(workers) as executor:
+            batched = num_functions / min(timeit.repeat(lambda: evaluate_graph_batch(expressions, x, executor=executor),
+                                            number=1, repeat=3))
+        report(f"batch, {workers} thread(s)", baseline, batched, "functions/s")
+        workers *= 2
+
+
+def bench_surface(size=4096):
+    expr = "exp(-(x^2+y^2)/50)*sin(x)*cos(y)+sqrt(abs(x*y))"
+    xs = np.linspace(-20, 20, size)
+    ys = np.linspace(-20, 20, size)
+    out = np.empty((size, size))
+    print(f"Heatmap of {expr} on a {size}x{size} grid (the output array is allocated beforehand)")
+    elapsed, peak = measure(lambda: evaluate_surface(expr, *np.meshgrid(xs, ys)))
+    print(f"  {'full meshgrid':20} {elapsed * 1000:8.0f} ms  peak {peak / 2**20:8.1f} MiB")
+    elapsed, peak = measure(lambda: evaluate_surface_tiled(expr, xs, ys, out))
+    print(f"  {'tiles':20} {elapsed * 1000:8.0f} ms  peak {peak / 2**20:8.1f} MiB")
+
+    # Pan the view by a tenth of its width ten times, as dragging a slider would
+    cache = SurfaceTileCache()
+    cache.render(expr, (-10, 10), (-10, 10), 800, 600)
+    start = time.perf_counter()
+    for step in range(1, 11):
+        cache.render(expr, (-10 + 2 * step, 10 + 2 * step), (-10, 10), 800, 600)
+    elapsed = (time.perf_counter() - start) / 10
+    print(f"  {'pan with tile cache':20} {elapsed * 1000:8.0f} ms per view, "
+          f"{cache.hits} tiles reused, {cache.misses} evaluated")
+
+
+def bench_implicit():
+    # Brute force samples every grid point and runs marching squares on every cell;
+    # the quadtree only refines cells the curve can pass through
+    expressions = ["x^2+y^2=25", "x^2/4+y^2=sin(3*x)+2", "sin(x)*cos(y)=0.3"]
+    print("Implicit curves on (-10, 10)^2, quadtree vs uniform grid")
+    for resolution in (512, 1024, 2048):
+        for expr in expressions:
+            def uniform():
+                xs = np.linspace(-10, 10, resolution + 1)
+                values = evaluate_surface(implicit_expression(expr), *np.meshgrid(xs, xs))
+                corners = np.stack([values[:-1, :-1], values[:-1, 1:], values[1:, 1:], values[1:, :-1]], axis=-1)
+                x0, y0 = np.meshgrid(xs[:-1], xs[:-1])
+                step = 20 / resolution
+                center = corners.mean(axis=-1)
+                return marching_squares(x0.ravel(), y0.ravel(), step, step, corners.reshape(-1, 4), center.ravel())
+            baseline = 1 / min(timeit.repeat(uniform, number=1, repeat=3))
+            quadtree = 1 / min(timeit.repeat(lambda: implicit_curve(expr, (-10, 10), (-10, 10), resolution),
+                                             number=1, repeat=3))
+            report(f"{expr} ({resolution}^2)", baseline, quadtree, "curves/s")
+
+
+def bench_parameters(num_points=200_000, steps=50):
+    # A slider sweep: the same expression with one parameter changing, as the plotter redraws it
+    expr = "a*sin(x)^2 + b*exp(-x^2/50)*cos(3*x) + c*sqrt(abs(x))"
+    print(f"Parameter sweep of {expr} over {num_points:,} points")
+
+    def substituted():
+        x = np.linspace(-10, 10, num_points)
+        for step in range(steps):
+            # What re-plotting did before: the numbers put into the text, compiled and evaluated in full
+            evaluate_graph(f"{step / 10}*sin(x)^2 + 2*exp(-x^2/50)*cos(3*x) + 0.5*sqrt(abs(x))", x)
+
+    def parametric():
+        parametric = ParametricExpression(expr)
+        for step in range(steps):
+            parametric.evaluate(-10, 10, {"a": step / 10, "b": 2, "c": 0.5}, num_points)
+    report("sweep", steps / min(timeit.repeat(substituted, number=1, repeat=3)),
+           steps / min(timeit.repeat(parametric, number=1, repeat=3)), "frames/s")
+
+
+def bench_backends(sizes=(10_000, 1_000_000, 10_000_000)):
+    # Every available backend on the same expressions; the kernel is compiled before timing
+    expressions = GRAPH_EXPRESSIONS + ["exp(-x^2/50)*sin(3*x) + sqrt(abs(x))*cos(x)^2",
+                                       "x^3 - 2*x^2 + 0.5*x - 1", "(x+1)*(x-2)*(x+3)/(x^2+1)"]
+    backends = [name for name, backend in GRAPH_BACKENDS.items() if backend.available()]
+    missing = [name for name in GRAPH_BACKENDS if name not in backends]
+    print("Graph evaluation per backend, million points/s" + (f" ({', '.join(missing)} not installed)"
+                                                              if missing else ""))
+    print(f"  {'expression':48} {'points':>10}" + "".join(f" {name:>10}" for name in backends))
+    try:
+        for expr in expressions:
+            for size in sizes:
+                x = np.linspace(-100, 100, size)
+                out = np.empty_like(x)
+                row = ""
+                for name in backends:
+                    graph_kernels.backend = name
+                    evaluate_graph_chunked(expr, x, out)  # compile outside the measurement
+                    number = max(1, 10_000_000 // size)
+                    row += f" {rate(lambda: evaluate_graph_chunked(expr, x, out), number) * size / 1e6:10.1f}"
+                print(f"  {expr:48} {size:10,}" + row)
+    finally:
+        graph_kernels.backend = "auto"
+
+
+def bench_lambdify(num_points=2000):
+    # Derivatives as the overlay draws them: the sympy result text, evaluated on the plot grid
+    print(f"Lambdified symbolic results vs eval of their text ({num_points} points)")
+    x = np.linspace(0.1, 10, num_points)
+    for expr in GRAPH_EXPRESSIONS:
+        derivative = run_symbolic("diff", expr, "x")
+        text = derivative.replace("**", "^")
+        def raw():
+            local_dict = {"x": x}
+            local_dict.update(ALLOWED_NAMES_GRAPH)
+            return eval(derivative, {"__builtins__": None}, local_dict)
+        try:
+            raw()
+        except Exception:
+            # sympy prints names the graph evaluator doesn't know, e.g. Abs or sign
+            print(f"  {'d/dx ' + expr:32} eval can't evaluate {derivative}")
+            continue
+        lambdified = rate(lambda: lambdify_expression(derivative)(x), 2000)
+        report("d/dx " + expr, rate(raw, 2000), lambdified)
+        report("d/dx " + expr + " (compiled)", rate(lambda: evaluate_graph(text, x), 2000), lambdified)
+    symbolic_pool.shutdown()
+
+
+def bench_cli(num_expressions=100_000):
+    # Throughput of the batch CLI per worker count; output goes to /dev/null
+    expressions = [f"sqrt({i})*sin(pi/{i % 7 + 1})+{i}^2" for i in range(num_expressions)]
+    print(f"Batch CLI over {num_expressions:,} expressions")
+    baseline = None
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        with open(os.devnull, "w") as output:
+            start = time.perf_counter()
+            run_batch(expressions, output, workers=workers)
+            throughput = num_expressions / (time.perf_counter() - start)
+        baseline = baseline or throughput
+        report(f"{workers} worker(s)", baseline, throughput, "expressions/s")
+        workers *= 2
+
+
+# Does what the calculator's main() does, but exits on the first paint event and prints
+# how long that took. Runs in a fresh interpreter so nothing is imported beforehand.
+STARTUP_SCRIPT = """
+import os, sys, time, runpy
+start = time.perf_counter()
+from PyQt6.QtCore import QObject, QEvent
+from PyQt6.QtWidgets import QApplication
+class FirstPaint(QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint:
+            print(f"first paint {time.perf_counter() - start:.6f}", flush=True)
+            # Imports after this line (e.g. by the sympy worker processes) happened after the paint
+            print("first paint", file=sys.stderr, flush=True)
+            os._exit(0)
+        return False
+calculator = runpy.run_path(sys.argv[1], run_name="calculator")
+app = QApplication(sys.argv)
+app.installEventFilter(FirstPaint(app))
+window = calculator["IntegratedCalculator"]()
+window.show()
+app.exec()
+"""
+
+STARTUP_PACKAGES = ["numpy", "sympy", "matplotlib", "PyQt6"]
+
+
+def bench_startup(runs=5):
+    examples = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.join(examples, "Calculator (Advanced with GraphPlot).py")
+    print("Time to first paint of the calculator window (python -X importtime)")
+    paints, imports = [], {}
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT, script],
+                                cwd=examples, capture_output=True, text=True, timeout=120)
+        paints.append(float(result.stdout.split()[-1]))
+        # Lines look like "import time:   self [us] |  cumulative | imported package"
+        for line in result.stderr.split("first paint")[0].splitlines():
+            parts = line.split("|")
+            if len(parts) == 3 and parts[2].strip() in STARTUP_PACKAGES:
+                imports.setdefault(parts[2].strip(), []).append(int(parts[1]))
+    print(f"  {'first paint (median)':32} {sorted(paints)[runs // 2] * 1000:8.0f} ms")
+    for package in STARTUP_PACKAGES:
+        if package in imports:
+            print(f"  {'import ' + package:32} {sorted(imports[package])[len(imports[package]) // 2] / 1000:8.0f} ms")
+        else:
+            print(f"  {'import ' + package:32}      not imported before the first paint")
+
+
+BENCHMARKS = {
+    "compile": bench_compile,
+    "chunked": bench_chunked,
+    "startup": bench_startup,
+    "lambdify": bench_lambdify,
+    "batch": bench_batch,
+    "cli": bench_cli,
+    "surface": bench_surface,
+    "implicit": bench_implicit,
+    "parameters": bench_parameters,
+    "optimize": bench_optimize,
+    "backends": bench_backends,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
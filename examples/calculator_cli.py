@@ -0,0 +1,260 @@
+import os
+import sys
+import csv
+import json
+import math
+import time
+import signal
+import argparse
+import collections
+import multiprocessing
+from multiprocessing.connection import wait
+import numpy as np
+import calculator_engine
+from calculator_engine import evaluate_expression
+
+# Evaluate calculator expressions without the GUI, one expression per line:
+#   python calculator_cli.py expressions.txt > results.jsonl
+#   python calculator_cli.py --format csv --timeout 2 < expressions.txt
+# Same names as the calculator, including diff('x^2'), integrate(...), simplify(...) and so on.
+# Results are written in input order as soon as they are ready.
+
+CHUNK_ITEMS = 64  # Expressions sent to a worker at a time, fewer round trips per expression
+CHUNKS_PER_WORKER = 4  # Input read ahead; with the output order this bounds memory
+DEFAULT_TIMEOUT = 5.0
+HARD_TIMEOUT_GRACE = 1.0  # Extra seconds before a worker that ignores its alarm is killed
+
+
+class ItemTimeout(BaseException):
+    # A BaseException so the calculator's own "except Exception" handlers don't swallow it
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise ItemTimeout()
+
+
+def plain_value(value):
+    # Numbers stay numbers in the output, anything else becomes its text. Runs in the
+    # worker, so a result that can't be written out is that item's error, not the batch's.
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, int):
+        try:
+            str(value)  # json and csv both fail on ints over sys.get_int_max_str_digits()
+        except ValueError:
+            raise ValueError(f"Result has more than {sys.get_int_max_str_digits()} digits") from None
+        return value
+    if isinstance(value, float) and math.isfinite(value):
+        return value
+    return str(value)
+
+
+def _worker(conn, timeout):
+    # The CLI's workers already run in parallel and are killed when stuck,
+    # so symbolic operations run right here instead of in more processes
+    calculator_engine.symbolic_pool.workers = 0
+    # SIGALRM interrupts a slow item and the worker carries on with the next one;
+    # where it doesn't exist (Windows) the parent's hard timeout still applies
+    alarm = hasattr(signal, "setitimer")
+    if alarm:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        chunk_id, offset, expressions = task
+        results = []
+        for expression in expressions:
+            try:
+                if alarm:
+                    signal.setitimer(signal.ITIMER_REAL, timeout)
+                try:
+                    results.append(("ok", plain_value(evaluate_expression(expression))))
+                finally:
+                    if alarm:
+                        signal.setitimer(signal.ITIMER_REAL, 0)
+            except ItemTimeout:
+                results.append(("timeout", None))
+            except Exception as e:
+                results.append(("error", str(e) or type(e).__name__))
+        conn.send((chunk_id, offset, results))
+
+
+class Worker:
+    def __init__(self, context, timeout):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker, args=(child_conn, timeout), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.deadline = None
+
+    def send(self, task, deadline):
+        self.task = task
+        self.deadline = deadline
+        self.conn.send(task)
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+def read_chunks(lines):
+    # Yields (first line number, expressions); blank lines are skipped but still counted
+    chunk = []
+    for number, line in enumerate(lines, 1):
+        expression = line.strip()
+        if expression:
+            chunk.append((number, expression))
+        if len(chunk) == CHUNK_ITEMS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Writer:
+    def __init__(self, output, output_format):
+        self.output = output
+        self.csv = None
+        if output_format == "csv":
+            self.csv = csv.writer(output)
+            self.csv.writerow(["line", "expression", "status", "result"])
+
+    def write(self, items, results):
+        for (number, expression), (status, result) in zip(items, results):
+            if self.csv:
+                self.csv.writerow([number, expression, status, "" if result is None else result])
+            else:
+                self.output.write(json.dumps({"line": number, "expression": expression,
+                                              "status": status, "result": result}) + "\n")
+        self.output.flush()
+
+
+def run_batch(lines, output, output_format="jsonl", workers=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Evaluate the expressions in lines (any iterable, read lazily) on a pool of worker
+    processes and write one result per expression to output, in input order.
+    Returns the number of results per status.
+    """
+    workers = workers or os.cpu_count() or 1
+    context = multiprocessing.get_context("spawn")
+    pool = [Worker(context, timeout) for _ in range(workers)]
+    writer = Writer(output, output_format)
+    chunks = read_chunks(lines)
+    retries = collections.deque()  # (chunk_id, offset, expressions) to send before new input
+    items = {}  # chunk_id -> the chunk's (line, expression) pairs
+    results = {}  # chunk_id -> results so far, None where still missing
+    missing = {}  # chunk_id -> number of results still missing
+    next_chunk = next_write = 0
+    counts = collections.Counter()
+    input_done = False
+
+    def next_task():
+        nonlocal next_chunk, input_done
+        if retries:
+            return retries.popleft()
+        if input_done or next_chunk - next_write >= workers * CHUNKS_PER_WORKER:
+            return None
+        chunk = next(chunks, None)
+        if chunk is None:
+            input_done = True
+            return None
+        chunk_id = next_chunk
+        next_chunk += 1
+        items[chunk_id] = chunk
+        results[chunk_id] = [None] * len(chunk)
+        missing[chunk_id] = len(chunk)
+        return chunk_id, 0, [expression for number, expression in chunk]
+
+    def store(chunk_id, offset, chunk_results):
+        results[chunk_id][offset:offset + len(chunk_results)] = chunk_results
+        missing[chunk_id] -= len(chunk_results)
+
+    def replace(worker):
+        # A stuck or crashed worker: one expression alone gets the blame, a chunk is
+        # retried one expression at a time to find the one that caused it
+        worker.kill()
+        pool[pool.index(worker)] = Worker(context, timeout)
+        chunk_id, offset, expressions = worker.task
+        if len(expressions) == 1:
+            crashed = worker.deadline > time.monotonic()
+            store(chunk_id, offset, [("error", "Worker crashed") if crashed else ("timeout", None)])
+        else:
+            for index, expression in enumerate(expressions):
+                retries.append((chunk_id, offset + index, [expression]))
+
+    try:
+        while True:
+            for worker in pool:
+                if worker.task is None:
+                    task = next_task()
+                    if task is None:
+                        break
+                    # The alarm in the worker normally fires first, this catches what it can't interrupt
+                    worker.send(task, time.monotonic() + len(task[2]) * timeout + HARD_TIMEOUT_GRACE)
+            busy = [worker for worker in pool if worker.task is not None]
+            if not busy:
+                break
+            wait_time = max(0, min(worker.deadline for worker in busy) - time.monotonic())
+            ready = wait([worker.conn for worker in busy], wait_time)
+            for worker in busy:
+                if worker.conn in ready:
+                    try:
+                        chunk_id, offset, chunk_results = worker.conn.recv()
+                    except (EOFError, OSError):
+                        replace(worker)
+                        continue
+                    store(chunk_id, offset, chunk_results)
+                    worker.task = None
+                elif worker.deadline <= time.monotonic():
+                    replace(worker)
+            # Write every finished chunk that is next in line, then forget it
+            while next_write in missing and missing[next_write] == 0:
+                chunk_results = results.pop(next_write)
+                writer.write(items.pop(next_write), chunk_results)
+                counts.update(status for status, result in chunk_results)
+                del missing[next_write]
+                next_write += 1
+    finally:
+        for worker in pool:
+            worker.kill()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate calculator expressions, one per line.")
+    parser.add_argument("input", nargs="?", help="file with one expression per line (default: stdin)")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    parser.add_argument("-f", "--format", choices=["jsonl", "csv"], default="jsonl")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("-t", "--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds per expression")
+    args = parser.parse_args()
+
+    lines = open(args.input, encoding="utf-8") if args.input else sys.stdin
+    output = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    start = time.perf_counter()
+    try:
+        counts = run_batch(lines, output, args.format, args.workers, args.timeout)
+    except BrokenPipeError:
+        # The reader went away (e.g. piped into head); keep Python from failing to flush at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+    finally:
+        if args.input:
+            lines.close()
+        if args.output:
+            output.close()
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+    print(f"{total} expressions in {elapsed:.1f} s ({total / max(elapsed, 1e-9):.0f}/s): "
+          + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
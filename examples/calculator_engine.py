@@ -0,0 +1,1751 @@
+import os
+import re
+import ast
+import math
+import time
+import sqlite3
+import hashlib
+import functools
+import importlib.util
+import queue
+import threading
+import multiprocessing
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# sympy is imported where it is used: it takes longer to load than the calculator's window
+
+# ---------------- Appdata Setup ----------------
+
+def get_appdata_folder():
+    if os.name == 'nt':
+        base_dir = os.getenv('APPDATA')
+        folder = os.path.join(base_dir, "UltraAdvancedCalculator")
+    else:
+        home = os.path.expanduser("~")
+        folder = os.path.join(home, ".ultra_advanced_calculator")
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return folder
+
+# ---------------- Symbolic Result Cache ----------------
+
+SYMBOLIC_CACHE_FILE = "symbolic_cache.db"
+SYMBOLIC_MEMORY_ITEMS = 512
+SYMBOLIC_DISK_BYTES = 32 * 2**20  # Least recently used results are evicted above this size
+
+class SymbolicCache:
+    """
+    Two levels: an in-memory LRU in front of an SQLite file in the app data folder,
+    so results survive restarts. The database is only opened on first use.
+    """
+    def __init__(self, path=None, max_bytes=SYMBOLIC_DISK_BYTES, memory_items=SYMBOLIC_MEMORY_ITEMS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+        self.disk_bytes = 0
+
+    def _open(self):
+        if self.db is None:
+            path = self.path or os.path.join(get_appdata_folder(), SYMBOLIC_CACHE_FILE)
+            # The batch CLI's worker processes share the file, WAL lets them read while one writes
+            self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS results ("
+                            "key TEXT PRIMARY KEY, result TEXT, size INTEGER, last_used REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+            self.disk_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        return self.db
+
+    def _remember(self, key, result):
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def get(self, key, disk=True):
+        with self.lock:
+            result = self.memory.get(key)
+            if result is not None:
+                self.memory.move_to_end(key)
+                return result
+            if not disk:
+                return None
+            db = self._open()
+            digest = hashlib.sha256(key.encode()).hexdigest()
+            row = db.execute("SELECT result FROM results WHERE key = ?", (digest,)).fetchone()
+            if row is None:
+                return None
+            with db:
+                db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), digest))
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, key, result, disk=True):
+        with self.lock:
+            self._remember(key, result)
+            if not disk:
+                return
+            db = self._open()
+            digest = hashlib.sha256(key.encode()).hexdigest()
+            size = len(digest) + len(result.encode())
+            with db:
+                old = db.execute("SELECT size FROM results WHERE key = ?", (digest,)).fetchone()
+                db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (digest, result, size, time.time()))
+                self.disk_bytes += size - (old[0] if old else 0)
+                while self.disk_bytes > self.max_bytes:
+                    rows = db.execute("SELECT key, size FROM results ORDER BY last_used LIMIT 64").fetchall()
+                    if not rows:
+                        break
+                    db.executemany("DELETE FROM results WHERE key = ?", [(row[0],) for row in rows])
+                    self.disk_bytes -= sum(row[1] for row in rows)
+
+symbolic_cache = SymbolicCache()
+
+SYMBOLIC_OPERATIONS = {
+    "diff": lambda sp, expr, var: sp.diff(expr, sp.Symbol(var, real=True)),
+    "integrate": lambda sp, expr, var: sp.integrate(expr, sp.Symbol(var, real=True)),
+    "simplify": lambda sp, expr, var: sp.simplify(expr),
+    "factor": lambda sp, expr, var: sp.factor(expr),
+    "expand": lambda sp, expr, var: sp.expand(expr),
+    # The cache key for the parsed input, so "x*2" and "2*x" share results
+    "canonical": lambda sp, expr, var: sp.srepr(expr),
+}
+
+def apply_symbolic(operation, expr, var=None):
+    import sympy as sp
+    # e is Euler's number everywhere else in the calculator
+    names = {"e": sp.E}
+    if var is not None:
+        # A real variable keeps e.g. d/dx abs(x) at sign(x) instead of a complex expression
+        names[var] = sp.Symbol(var, real=True)
+    return str(SYMBOLIC_OPERATIONS[operation](sp, sp.sympify(expr, locals=names), var))
+
+# ---------------- Symbolic Worker Processes ----------------
+
+SYMBOLIC_WORKERS = 2
+SYMBOLIC_TIMEOUT = 10.0  # Seconds before a worker is killed and replaced
+SYMBOLIC_MEMORY_LIMIT = 2 * 2**30  # Address space per worker, only enforced where resource is available
+
+class SymbolicTimeout(Exception):
+    pass
+
+def _limit_memory(limit):
+    try:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def _symbolic_worker(conn, memory_limit):
+    # Runs in a child process; sympy is imported before the first job arrives
+    import sympy
+    _limit_memory(memory_limit)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        operation, expr, var = job
+        try:
+            reply = ("ok", apply_symbolic(operation, expr, var))
+        except MemoryError:
+            reply = ("error", "Out of memory")
+        except Exception as e:
+            reply = ("error", str(e))
+        conn.send(reply)
+
+class SymbolicProcessPool:
+    """
+    Runs sympy operations in long-lived worker processes. Unlike a thread, a process
+    can be killed: a job that runs past its timeout, or whose JobToken is cancelled,
+    takes its worker down with it and a fresh one is started in its place.
+    With workers=0 operations run in the calling thread, without a timeout.
+    """
+    def __init__(self, workers=SYMBOLIC_WORKERS, timeout=SYMBOLIC_TIMEOUT, memory_limit=SYMBOLIC_MEMORY_LIMIT):
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        # spawn behaves the same on every platform and doesn't copy the GUI into the child
+        self.context = multiprocessing.get_context("spawn")
+        self.idle = queue.Queue()
+        self.started = False
+        self.lock = threading.Lock()
+
+    def _spawn(self):
+        conn, child_conn = self.context.Pipe()
+        process = self.context.Process(target=_symbolic_worker, args=(child_conn, self.memory_limit), daemon=True)
+        process.start()
+        child_conn.close()
+        self.idle.put((process, conn))
+
+    def _kill(self, worker):
+        process, conn = worker
+        process.kill()
+        process.join()
+        conn.close()
+
+    def start(self):
+        # Call early so the workers have sympy loaded before the first job
+        with self.lock:
+            if not self.started:
+                self.started = True
+                for _ in range(self.workers):
+                    self._spawn()
+
+    def run(self, operation, expr, var=None, cancelled=None):
+        if self.workers == 0:
+            return apply_symbolic(operation, expr, var)
+        self.start()
+        worker = self.idle.get()
+        process, conn = worker
+        try:
+            conn.send((operation, expr, var))
+            deadline = time.monotonic() + self.timeout
+            while not conn.poll(0.05):
+                if cancelled is not None and cancelled():
+                    raise JobCancelled()
+                if time.monotonic() > deadline:
+                    raise SymbolicTimeout(f"{operation} took longer than {self.timeout:g} s")
+            status, result = conn.recv()
+        except BaseException:
+            # Timed out, cancelled or crashed (e.g. killed for memory): replace the worker
+            self._kill(worker)
+            self._spawn()
+            raise
+        self.idle.put(worker)
+        if status != "ok":
+            raise ValueError(result)
+        return result
+
+    def shutdown(self):
+        with self.lock:
+            self.started = True  # Don't start new workers after this
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self._kill(worker)
+
+symbolic_pool = SymbolicProcessPool()
+
+def run_symbolic(operation, expr, var=None):
+    """
+    Run a sympy operation in a worker process, or return its cached result. Results
+    are keyed by the canonical form of the parsed input (sp.srepr), so "x*2" and "2*x"
+    share an entry; the raw string is also kept in memory to skip parsing on exact repeats.
+    Parsing happens in the worker too, since sympify alone can run forever (9**9**9).
+    Raises SymbolicTimeout if the worker had to be killed.
+    """
+    raw_key = f"{operation}|{var}|raw|{expr}"
+    result = symbolic_cache.get(raw_key, disk=False)
+    if result is None:
+        token = current_token()
+        cancelled = token.cancelled if token else None
+        canonical = symbolic_pool.run("canonical", expr, var, cancelled)
+        key = f"{operation}|{var}|{canonical}"
+        result = symbolic_cache.get(key)
+        if result is None:
+            result = symbolic_pool.run(operation, canonical, var, cancelled)
+            symbolic_cache.put(key, result)
+        symbolic_cache.put(raw_key, result, disk=False)
+    return result
+
+# ---------------- Advanced Calculation Functions ----------------
+
+def symbolic_result(operation, expr, var=None):
+    try:
+        return run_symbolic(operation, expr, var)
+    except SymbolicTimeout:
+        return "Timeout"
+    except JobCancelled:
+        raise
+    except Exception:
+        return "Error"
+
+def diff_func(expr, var='x'):
+    return symbolic_result("diff", expr, var)
+
+def integrate_func(expr, var='x'):
+    return symbolic_result("integrate", expr, var)
+
+def simplify_func(expr):
+    return symbolic_result("simplify", expr)
+
+def factor_func(expr):
+    return symbolic_result("factor", expr)
+
+def expand_func(expr):
+    return symbolic_result("expand", expr)
+
+# Allowed names for direct evaluation
+ALLOWED_NAMES = {
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+    "asin": math.asin,
+    "acos": math.acos,
+    "atan": math.atan,
+    "sinh": math.sinh,
+    "cosh": math.cosh,
+    "tanh": math.tanh,
+    "log": math.log,
+    "log10": math.log10,
+    "exp": math.exp,
+    "sqrt": math.sqrt,
+    "factorial": math.factorial,
+    "pi": math.pi,
+    "e": math.e,
+    "abs": abs,
+    "round": round,
+    "pow": pow,
+    # Symbolic functions:
+    "diff": diff_func,
+    "integrate": integrate_func,
+    "simplify": simplify_func,
+    "factorize": factor_func,
+    "expand": expand_func
+}
+
+# Allowed names for graph evaluation using numpy
+ALLOWED_NAMES_GRAPH = {
+    "sin": np.sin,
+    "cos": np.cos,
+    "tan": np.tan,
+    "arcsin": np.arcsin,
+    "arccos": np.arccos,
+    "arctan": np.arctan,
+    "sinh": np.sinh,
+    "cosh": np.cosh,
+    "tanh": np.tanh,
+    "log": np.log,
+    "log10": np.log10,
+    "exp": np.exp,
+    "sqrt": np.sqrt,
+    "pi": np.pi,
+    "e": np.e,
+    "abs": np.abs,
+    "round": np.round,
+    "power": np.power,
+    "np": np
+}
+
+# ---------------- Expression Compiler ----------------
+
+EXPRESSION_CACHE_SIZE = 256
+
+# Names each kind of expression may use; frozensets so they can be part of the cache key
+CALC_NAMES = frozenset(ALLOWED_NAMES)
+GRAPH_NAMES = frozenset(ALLOWED_NAMES_GRAPH) | {"x"}
+
+_CALC_GLOBALS = {"__builtins__": None, **ALLOWED_NAMES}
+_GRAPH_GLOBALS = {"__builtins__": None, **ALLOWED_NAMES_GRAPH}
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.keyword,
+    ast.Name, ast.Load, ast.Constant, ast.Attribute, ast.Tuple,
+    ast.operator, ast.unaryop, ast.cmpop
+)
+
+def normalize_expression(expression):
+    return expression.replace("^", "**").strip()
+
+def validate_expression(tree, allowed):
+    """
+    Reject anything but arithmetic, calls and the allowed names.
+    Attribute access is limited to public numpy functions (np.sin and the like).
+    """
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f"Unsupported syntax: {type(node).__name__}")
+        if isinstance(node, ast.Name) and node.id not in allowed:
+            raise ValueError(f"Unknown name: {node.id}")
+        if isinstance(node, ast.Attribute):
+            if not (isinstance(node.value, ast.Name) and node.value.id == "np" and "np" in allowed
+                    and not node.attr.startswith("_")):
+                raise ValueError(f"Unsupported attribute: {node.attr}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, complex, str)):
+            raise ValueError(f"Unsupported constant: {node.value!r}")
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def _compile_normalized(expression, allowed, inplace):
+    tree = ast.parse(expression, mode="eval")
+    validate_expression(tree, allowed)
+    if "x" in allowed:
+        # Graph expressions run over whole arrays, where every operation saved is a pass over memory
+        tree = optimize_expression(tree, inplace)
+    return compile(tree, "<expression>", "eval")
+
+def compile_expression(expression, allowed, inplace=False):
+    """
+    Parse, validate and compile an expression once; later calls with the same
+    expression return the cached code object. inplace compiles graph expressions
+    for large arrays (see optimize_expression).
+    """
+    return _compile_normalized(normalize_expression(expression), allowed, inplace)
+
+def evaluate_expression(expression):
+    return eval(compile_expression(expression, CALC_NAMES), _CALC_GLOBALS)
+
+def evaluate_graph(expression, x):
+    code = compile_expression(expression, GRAPH_NAMES, np.size(x) >= INPLACE_MIN_POINTS)
+    y = eval(code, _GRAPH_GLOBALS, {"x": x})
+    if not isinstance(y, np.ndarray):
+        y = np.full_like(x, y)
+    return y
+
+# ---------------- Lambdified Symbolic Results ----------------
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def symbolic_expression(text):
+    # Results of run_symbolic are str() of sympy expressions, so they parse back exactly
+    import sympy as sp
+    return sp.sympify(text, locals={"e": sp.E})
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def lambdify_expression(text):
+    """
+    Compile a symbolic result such as the output of diff_func into a vectorized
+    function of x. Unlike the graph compiler this accepts anything sympy can print
+    (erf, Abs, sign, ...), and the code is generated once per distinct result.
+    """
+    import sympy as sp
+    expr = symbolic_expression(text)
+    x = sp.Symbol("x")
+    unknown = expr.free_symbols - {x}
+    if unknown:
+        raise ValueError("Unknown symbols: " + ", ".join(sorted(map(str, unknown))))
+    if expr.has(sp.Integral):
+        raise ValueError("No closed form")
+    # scipy (if installed) supplies vectorized special functions such as erf
+    modules = ["scipy", "numpy"] if importlib.util.find_spec("scipy") else ["numpy"]
+    func = sp.lambdify(x, expr, modules=modules)
+    scalar_func = np.vectorize(func, otypes=[complex])
+
+    def evaluate(values):
+        with np.errstate(all="ignore"):
+            try:
+                result = np.asarray(func(values))
+            except TypeError:
+                # Functions numpy lacks fall back to the math module, one value at a time
+                result = scalar_func(values)
+        if result.dtype.kind == "c":
+            result = np.where(np.abs(result.imag) < 1e-12, result.real, np.nan)
+        if result.shape != np.shape(values):
+            # Constant results come back as a single number
+            result = np.broadcast_to(result, np.shape(values))
+        return result.astype(float, copy=False)
+    return evaluate
+
+def evaluate_symbolic(operation, expression, x):
+    """
+    Evaluate diff or integrate of a graph expression over x, e.g. to draw f' and the
+    antiderivative on the grid f was sampled on.
+    """
+    return lambdify_expression(run_symbolic(operation, expression, "x"))(x)
+
+# ---------------- Chunked Evaluation ----------------
+
+# Points per chunk: small enough that a chunk and its temporaries stay in the CPU cache
+CHUNK_SIZE = 32768
+
+# Functions that work element by element, so evaluating chunks separately gives the same result
+_ELEMENTWISE = {name for name, value in ALLOWED_NAMES_GRAPH.items() if isinstance(value, np.ufunc)}
+_ELEMENTWISE.add("round")
+
+_executor = None
+
+def get_executor():
+    # One pool for the whole app; numpy releases the GIL, so the chunks run in parallel
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+    return _executor
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def _is_elementwise(expression):
+    for node in ast.walk(ast.parse(expression, mode="eval")):
+        if isinstance(node, ast.Call):
+            func = node.func
+            if isinstance(func, ast.Name):
+                if func.id not in _ELEMENTWISE:
+                    return False
+            elif not isinstance(getattr(np, func.attr, None), np.ufunc):
+                return False
+    return True
+
+def is_elementwise(expression):
+    """
+    True if every call in the expression is a ufunc (or round). Reductions such as
+    np.mean(x) need the whole array at once and can't be split into chunks.
+    """
+    return _is_elementwise(normalize_expression(expression))
+
+def evaluate_graph_chunked(expression, x, out=None, chunk_size=CHUNK_SIZE, executor=None):
+    """
+    Evaluate a graph expression over x in chunks on a thread pool, writing into out.
+    Only one chunk's temporaries per thread exist at a time, so memory stays bounded
+    however many points are sampled. The kernel comes from graph_kernels, so hot
+    expressions run JIT-compiled when a compiler is installed.
+    """
+    kernel = graph_kernels.kernel(expression, points=len(x))
+    if out is None:
+        out = np.empty(x.shape, dtype=np.float64)
+    if len(x) <= chunk_size or not is_elementwise(expression):
+        kernel(x, out)
+        return out
+
+    def evaluate_chunk(start):
+        stop = start + chunk_size
+        kernel(x[start:stop], out[start:stop])
+
+    executor = executor or get_executor()
+    # list() waits for all chunks and re-raises the first error
+    list(executor.map(evaluate_chunk, range(0, len(x), chunk_size)))
+    return out
+
+# ---------------- Batched Evaluation ----------------
+
+BATCH_MIN_CHUNK = 4096  # Below this, handing chunks to threads costs more than it saves
+
+# Nodes worth computing once when they appear more than once
+_CSE_NODES = (ast.BinOp, ast.UnaryOp, ast.Call, ast.Compare)
+
+def split_expressions(text):
+    # Several functions can be plotted at once: "sin(x); cos(x); x^2"
+    return [part.strip() for part in text.split(";") if part.strip()]
+
+class _CommonSubexpressions(ast.NodeTransformer):
+    """
+    Replaces every subtree that occurs more than once (within or across expressions)
+    with a temporary, and collects the assignments that compute them in order.
+    """
+    def __init__(self, counts):
+        self.counts = counts
+        self.names = {}
+        self.assignments = []
+
+    def visit(self, node):
+        if not isinstance(node, _CSE_NODES):
+            return self.generic_visit(node)
+        key = ast.dump(node)
+        node = self.generic_visit(node)  # Children first, so temporaries can use each other
+        if self.counts[key] < 2:
+            return node
+        if key not in self.names:
+            self.names[key] = f"_t{len(self.names)}"
+            self.assignments.append(f"{self.names[key]} = {ast.unparse(node)}")
+        return ast.Name(self.names[key], ast.Load())
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def _compile_batch(expressions):
+    bodies = []
+    for expression in expressions:
+        tree = ast.parse(expression, mode="eval")
+        validate_expression(tree, GRAPH_NAMES)
+        bodies.append(_FoldConstants().visit(tree.body))
+    counts = Counter(ast.dump(node) for body in bodies for node in ast.walk(body) if isinstance(node, _CSE_NODES))
+    cse = _CommonSubexpressions(counts)
+    results = [ast.unparse(cse.visit(body)) for body in bodies]
+    # Generated from validated trees only, so it can't use anything the graph names don't allow
+    source = "def _batch(x):\n"
+    for line in cse.assignments + [f"return ({', '.join(results)},)"]:
+        source += f"    {line}\n"
+    namespace = dict(_GRAPH_GLOBALS)
+    exec(compile(source, "<batch>", "exec"), namespace)
+    return namespace["_batch"]
+
+def evaluate_graph_batch(expressions, x, chunk_size=None, executor=None):
+    """
+    Evaluate several graph expressions over one shared x array and return one row
+    per expression. Subexpressions they have in common are computed once per chunk,
+    and the chunks of x are evaluated in parallel.
+    """
+    normalized = tuple(normalize_expression(expression) for expression in expressions)
+    batch = _compile_batch(normalized)
+    out = np.empty((len(normalized), len(x)), dtype=np.float64)
+    if chunk_size is None:
+        chunk_size = max(BATCH_MIN_CHUNK, -(-len(x) // (os.cpu_count() or 1)))
+    if not all(is_elementwise(expression) for expression in normalized):
+        chunk_size = len(x)
+
+    def evaluate_chunk(start):
+        stop = start + chunk_size
+        for row, y in zip(out, batch(x[start:stop])):
+            row[start:stop] = y
+
+    executor = executor or get_executor()
+    list(executor.map(evaluate_chunk, range(0, len(x), max(chunk_size, 1))))
+    return out
+
+# ---------------- Expression Optimizer ----------------
+
+INPLACE_MIN_POINTS = 16384  # Smaller arrays are cheap to allocate; reusing them costs more than it saves
+
+# ndarray operators and the ufuncs they call
+_INPLACE_BINARY = {ast.Add: "add", ast.Sub: "subtract", ast.Mult: "multiply", ast.Div: "true_divide",
+                   ast.FloorDiv: "floor_divide", ast.Mod: "remainder", ast.Pow: "power"}
+_INPLACE_UNARY = {ast.USub: "negative", ast.UAdd: "positive"}
+# Powers ndarray computes with a faster ufunc than np.power
+_INPLACE_POWERS = {2: "square", 0.5: "sqrt", -1: "reciprocal"}
+
+def _constant_node(value):
+    # NumPy scalars keep their type, so 1/sin(0) is still inf and cos(3)**0.5 still nan;
+    # negative literals get an explicit minus, so unparse can't turn (-2)**x into -2**x
+    if isinstance(value, np.generic):
+        return ast.Call(ast.Attribute(ast.Name("np", ast.Load()), type(value).__name__, ast.Load()),
+                        [_constant_node(value.item())], [])
+    if ast.unparse(ast.Constant(value)).startswith("-"):
+        return ast.UnaryOp(ast.USub(), ast.Constant(-value))
+    return ast.Constant(value)
+
+class _FoldConstants(ast.NodeTransformer):
+    """
+    Evaluates subtrees that only use numbers and the allowed names once, when the
+    expression is compiled: sin(x)*exp(2*pi) becomes sin(x)*np.float64(535.4916555247646).
+    """
+    def visit(self, node):
+        if isinstance(node, _CSE_NODES) and all(child.id in ALLOWED_NAMES_GRAPH for child in ast.walk(node)
+                                                if isinstance(child, ast.Name)):
+            try:
+                with np.errstate(all="ignore"):
+                    value = eval(compile(ast.Expression(node), "<constant>", "eval"), _GRAPH_GLOBALS)
+            except Exception:
+                value = None  # e.g. 1/0, left to fail when the expression is evaluated
+            if isinstance(value, int) or (isinstance(value, (float, complex, np.number)) and np.isfinite(value)):
+                return ast.copy_location(_constant_node(value), node)
+        return self.generic_visit(node)
+
+class _NameRepeated(ast.NodeTransformer):
+    """
+    _CommonSubexpressions for a single expression: the first evaluation of a repeated
+    subtree is kept as (_t0 := ...), the later ones read _t0.
+    """
+    def __init__(self, counts):
+        self.counts = counts
+        self.names = {}
+
+    def visit(self, node):
+        if not isinstance(node, _CSE_NODES):
+            return self.generic_visit(node)
+        key = ast.dump(node)
+        if key in self.names:
+            return ast.Name(self.names[key], ast.Load())
+        node = self.generic_visit(node)  # Children first: they are evaluated before the node
+        if self.counts[key] < 2:
+            return node
+        self.names[key] = f"_t{len(self.names)}"
+        return ast.NamedExpr(ast.Name(self.names[key], ast.Store()), node)
+
+def _ufunc(node):
+    # The ufunc a call node refers to, or None
+    func = node.func
+    if isinstance(func, ast.Name):
+        value = ALLOWED_NAMES_GRAPH.get(func.id)
+    else:
+        value = getattr(np, func.attr, None)
+    return value if isinstance(value, np.ufunc) else None
+
+def _is_temporary(node, final_reads=frozenset()):
+    # Nodes that evaluate to a new array nothing else needs: arithmetic, ufunc calls and the
+    # last read of a named subexpression (by node id)
+    if isinstance(node, (ast.BinOp, ast.UnaryOp)):
+        return True
+    if isinstance(node, ast.Name):
+        return id(node) in final_reads
+    return isinstance(node, ast.Call) and (
+        _ufunc(node) is not None or (isinstance(node.func, ast.Name) and node.func.id.startswith("_inplace")))
+
+def _held_names(node):
+    # Named arrays the value of node may be: itself when it is a name, none for a new array
+    if isinstance(node, ast.Name):
+        return {node.id}
+    if isinstance(node, ast.NamedExpr):
+        return {node.target.id} | _held_names(node.value)
+    if _is_temporary(node) or isinstance(node, ast.Constant):
+        return set()
+    return {child.id for child in ast.walk(node) if isinstance(child, ast.Name)}
+
+class _FinalReads:
+    """
+    Finds the last read of every named temporary that is safe to overwrite: no
+    operand evaluated before it and still waiting for its operation holds the same array.
+    Child nodes are visited in evaluation order, so the last read seen per name is its final read.
+    """
+    def __init__(self):
+        self.last = {}
+        self.temporary = set()
+
+    def scan(self, node, pending):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            self.last[node.id] = (node, node.id in pending)
+        if isinstance(node, ast.NamedExpr) and _is_temporary(node.value):
+            self.temporary.add(node.target.id)
+        held = set(pending)
+        for child in ast.iter_child_nodes(node):
+            self.scan(child, held)
+            held = held | _held_names(child)
+
+    def final_reads(self, tree):
+        self.scan(tree, set())
+        return {id(node) for name, (node, pending) in self.last.items() if name in self.temporary and not pending}
+
+def _inplace_binary(ufunc, left, right, reuse_right):
+    # Writes the result over the temporary operand when it has the result's type and shape
+    target, other = (right, left) if reuse_right else (left, right)
+    if (isinstance(target, np.ndarray) and target.dtype == np.result_type(left, right)
+            and (np.ndim(other) == 0 or np.shape(other) == target.shape)):
+        return ufunc(left, right, out=target)
+    return ufunc(left, right)
+
+def _inplace_unary(ufunc, operand):
+    # Only float64 -> float64 ufuncs are rewritten to this, see _ReuseTemporaries
+    if isinstance(operand, np.ndarray) and operand.dtype == np.float64:
+        return ufunc(operand, out=operand)
+    return ufunc(operand)
+
+class _DropUnusedNames(ast.NodeTransformer):
+    # Inside a repeated subtree, parts of it are named but only evaluated once
+    def __init__(self, used):
+        self.used = used
+
+    def visit_NamedExpr(self, node):
+        node = self.generic_visit(node)
+        return node if node.target.id in self.used else node.value
+
+class _ReuseTemporaries(ast.NodeTransformer):
+    """
+    Turns operations on a temporary into in-place ufunc calls, so exp(-x**2/2)
+    allocates one array instead of four.
+    """
+    def __init__(self, final_reads):
+        self.final_reads = final_reads
+
+    def temporary(self, node):
+        return _is_temporary(node, self.final_reads)
+
+    def visit_BinOp(self, node):
+        node = self.generic_visit(node)
+        name = _INPLACE_BINARY.get(type(node.op))
+        if name is None or not (self.temporary(node.left) or self.temporary(node.right)):
+            return node
+        if (isinstance(node.op, ast.Pow) and isinstance(node.right, ast.Constant)
+                and node.right.value in _INPLACE_POWERS):
+            if not self.temporary(node.left):
+                return node
+            return self.call("_inplace_unary", [self.ufunc(_INPLACE_POWERS[node.right.value]), node.left], node)
+        return self.call("_inplace_binary", [self.ufunc(name), node.left, node.right,
+                                             ast.Constant(not self.temporary(node.left))], node)
+
+    def visit_UnaryOp(self, node):
+        node = self.generic_visit(node)
+        name = _INPLACE_UNARY.get(type(node.op))
+        if name is None or not self.temporary(node.operand):
+            return node
+        return self.call("_inplace_unary", [self.ufunc(name), node.operand], node)
+
+    def visit_Call(self, node):
+        node = self.generic_visit(node)
+        ufunc = _ufunc(node)
+        if (ufunc is None or "d->d" not in ufunc.types or len(node.args) != 1 or node.keywords
+                or not self.temporary(node.args[0])):
+            return node
+        return self.call("_inplace_unary", [node.func, node.args[0]], node)
+
+    def ufunc(self, name):
+        return ast.Attribute(ast.Name("np", ast.Load()), name, ast.Load())
+
+    def call(self, helper, args, node):
+        return ast.copy_location(ast.Call(ast.Name(helper, ast.Load()), args, []), node)
+
+_GRAPH_GLOBALS["_inplace_binary"] = _inplace_binary
+_GRAPH_GLOBALS["_inplace_unary"] = _inplace_unary
+
+def optimize_expression(tree, inplace=False):
+    """
+    Rewrite a validated graph expression tree before it is compiled: constant subtrees
+    are folded, repeated subexpressions are evaluated once, and with inplace,
+    temporaries are overwritten by the operations that consume them instead of
+    allocating a new array each time. Returns the new tree.
+    """
+    tree = _FoldConstants().visit(tree)
+    counts = Counter(ast.dump(node) for node in ast.walk(tree) if isinstance(node, _CSE_NODES))
+    tree = _NameRepeated(counts).visit(tree)
+    used = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)}
+    tree = _DropUnusedNames(used).visit(tree)
+    if inplace:
+        tree = _ReuseTemporaries(_FinalReads().final_reads(tree)).visit(tree)
+    return ast.fix_missing_locations(tree)
+
+# ---------------- Evaluation Backends ----------------
+
+JIT_HOT_POINTS = 2_000_000  # Points evaluated for one expression before compiling it is worth the wait
+JIT_PROBE_POINTS = 65536  # Grid a compiled kernel is timed on against NumPy
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def _numpy_kernel(expression, parameters):
+    allowed = GRAPH_NAMES | frozenset(parameters)
+    small = compile_expression(expression, allowed)
+    large = compile_expression(expression, allowed, inplace=True)
+
+    def kernel(x, out, *values):
+        local_dict = dict(zip(parameters, values))
+        local_dict["x"] = x
+        out[...] = eval(large if len(x) >= INPLACE_MIN_POINTS else small, _GRAPH_GLOBALS, local_dict)
+    return kernel
+
+class NumpyBackend:
+    """
+    The optimized code object evaluated on whole arrays, one pass per operation.
+    Supports every graph expression.
+    """
+    name = "numpy"
+
+    def available(self):
+        return True
+
+    def supports(self, expression, parameters=()):
+        return True
+
+    def kernel(self, expression, parameters=()):
+        return _numpy_kernel(expression, parameters)
+
+class _RenameX(ast.NodeTransformer):
+    # Inside a kernel _x is the current point; free_parameters never returns _ names
+    def visit_Name(self, node):
+        return ast.copy_location(ast.Name("_x", node.ctx), node) if node.id == "x" else node
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def _jit_supports(expression, parameters):
+    tree = ast.parse(expression, mode="eval")
+    validate_expression(tree, GRAPH_NAMES | set(parameters))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and (_ufunc(node) is None or node.keywords):
+            return False
+        if isinstance(node, ast.Compare) and len(node.ops) > 1:
+            return False  # a < x < b is an error on arrays, but would work point by point
+        if isinstance(node, (ast.Tuple, ast.keyword)) or (isinstance(node, ast.Constant)
+                                                          and isinstance(node.value, str)):
+            return False
+    return True
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def _numba_kernel(expression, parameters):
+    import numba
+    tree = _FoldConstants().visit(ast.parse(expression, mode="eval"))
+    body = ast.unparse(_RenameX().visit(tree.body))
+    # Generated from a validated tree only (see _jit_supports), like _compile_batch
+    source = (f"def _kernel(_xs, _out{''.join(', ' + name for name in parameters)}):\n"
+              f"    for _i in range(_xs.shape[0]):\n"
+              f"        _x = _xs[_i]\n"
+              f"        _out[_i] = {body}\n")
+    namespace = dict(_GRAPH_GLOBALS)
+    exec(compile(source, "<kernel>", "exec"), namespace)
+    # nogil lets the chunk threads run kernels side by side; error_model gives numpy's inf and nan
+    return numba.njit(nogil=True, error_model="numpy")(namespace["_kernel"])
+
+class NumbaBackend:
+    """
+    Compiles an expression into one loop over x with numba, computing each point
+    in a single pass instead of one pass over memory per operation. Only available
+    when numba is installed, and only for arithmetic, single comparisons and ufuncs.
+    """
+    name = "numba"
+
+    def available(self):
+        return importlib.util.find_spec("numba") is not None
+
+    def supports(self, expression, parameters=()):
+        return _jit_supports(expression, parameters)
+
+    def kernel(self, expression, parameters=()):
+        kernel = _numba_kernel(expression, parameters)
+        # Compiles for float64 arrays right away instead of on the first real call
+        kernel(np.zeros(1), np.zeros(1), *[0.0] * len(parameters))
+        return kernel
+
+# Anything with the same methods can be added here and selected through graph_kernels.backend
+GRAPH_BACKENDS = {backend.name: backend for backend in (NumpyBackend(), NumbaBackend())}
+
+def _probe(kernel, x, values):
+    # Best of three timings, and the output to check against NumPy's
+    out = np.empty_like(x)
+    timings = []
+    with np.errstate(all="ignore"):
+        for _ in range(3):
+            start = time.perf_counter()
+            kernel(x, out, *values)
+            timings.append(time.perf_counter() - start)
+    return min(timings), out
+
+class GraphKernels:
+    """
+    Chooses the kernel a graph expression is evaluated with. A kernel is called as
+    kernel(x, out, *parameter_values) and writes f(x) into out.
+
+    backend is "auto", or the name of a backend in GRAPH_BACKENDS to use it for
+    every expression it supports. With "auto" expressions run on NumPy until one has
+    been evaluated over JIT_HOT_POINTS points. Its JIT kernel is then compiled on a
+    background thread, so plotting never waits for the compiler, and used from then
+    on if it matches NumPy's results on a probe grid and beats its time: fused loops
+    win on arithmetic, but NumPy's vectorized sin, exp and tanh are hard to beat one
+    point at a time. Both per-expression tables keep the max_size most recent entries.
+    """
+    def __init__(self, backend="auto", max_size=EXPRESSION_CACHE_SIZE):
+        self.backend = backend
+        self.max_size = max_size
+        self.compiled = OrderedDict()  # (expression, parameters) -> faster JIT kernel, or None if NumPy is faster
+        self.points = OrderedDict()  # (expression, parameters) -> points evaluated so far
+        self.compiling = set()
+        self.lock = threading.Lock()
+
+    def _remember(self, table, key, value):
+        table[key] = value
+        table.move_to_end(key)
+        while len(table) > self.max_size:
+            table.popitem(last=False)
+
+    def kernel(self, expression, parameters=(), points=0):
+        numpy_kernel = GRAPH_BACKENDS["numpy"].kernel(normalize_expression(expression), tuple(parameters))
+        return self.jit_kernel(expression, parameters, points) or numpy_kernel
+
+    def jit_kernel(self, expression, parameters=(), points=0):
+        """
+        The compiled kernel for an expression, or None while it runs on NumPy.
+        points is the number of points about to be evaluated, counted towards JIT_HOT_POINTS.
+        """
+        key = (normalize_expression(expression), tuple(parameters))
+        if self.backend != "auto":
+            return None if self.backend == "numpy" else self.compile_with(GRAPH_BACKENDS[self.backend], key)
+
+        with self.lock:
+            if key in self.compiled:
+                self.compiled.move_to_end(key)
+                return self.compiled[key]
+            self._remember(self.points, key, self.points.get(key, 0) + points)
+            start = key not in self.compiling and self.points[key] >= JIT_HOT_POINTS
+            if start:
+                self.compiling.add(key)
+        if start:
+            threading.Thread(target=self.compile, args=(key,), daemon=True).start()
+        return None
+
+    def compile_with(self, backend, key):
+        if not (backend.available() and backend.supports(*key)):
+            return None
+        try:
+            return backend.kernel(*key)
+        except Exception:
+            return None  # e.g. a ufunc the compiler doesn't know; NumPy still works
+
+    def compile(self, key):
+        # Background thread: the fastest kernel that agrees with NumPy on the probe grid wins
+        probe = np.linspace(-10, 10, JIT_PROBE_POINTS)
+        values = [1.0] * len(key[1])
+        best = None
+        try:
+            best_time, expected = _probe(GRAPH_BACKENDS["numpy"].kernel(*key), probe, values)
+            for name, backend in GRAPH_BACKENDS.items():
+                kernel = self.compile_with(backend, key) if name != "numpy" else None
+                if kernel is not None:
+                    elapsed, out = _probe(kernel, probe, values)
+                    if elapsed < best_time and np.allclose(out, expected, equal_nan=True):
+                        best, best_time = kernel, elapsed
+        except Exception:
+            best = None  # Fails on NumPy too; evaluating it reports the error as before
+        with self.lock:
+            self._remember(self.compiled, key, best)
+            self.points.pop(key, None)
+            self.compiling.discard(key)
+
+graph_kernels = GraphKernels()
+
+# ---------------- Adaptive Sampling ----------------
+
+ADAPTIVE_INITIAL_POINTS = 1000
+ADAPTIVE_MAX_POINTS = 50000
+ADAPTIVE_MAX_DEPTH = 16
+
+def sample_adaptive(expression, lower, upper, initial_points=ADAPTIVE_INITIAL_POINTS,
+                    max_points=ADAPTIVE_MAX_POINTS, tolerance=1e-3, max_depth=ADAPTIVE_MAX_DEPTH,
+                    checkpoint=None):
+    """
+    Sample a graph expression densely where it bends or jumps and sparsely where it is flat.
+
+    Starting from a uniform grid, every interval whose midpoint is further than
+    tolerance (relative to the typical y range) from the straight line between its
+    ends is split, until nothing needs splitting or max_points is reached. Jumps that
+    are still unresolved at the end (poles such as tan(x) at pi/2) get a NaN so the
+    line is broken there instead of drawn straight across.
+
+    checkpoint, if given, is called between refinement rounds and may raise
+    JobCancelled to abandon the work.
+    """
+    lower, upper = min(lower, upper), max(lower, upper)
+    x = np.linspace(lower, upper, initial_points)
+    y = evaluate_graph_chunked(expression, x)
+    if not is_elementwise(expression) or lower == upper:
+        return x, y
+
+    # Intervals to test, with the error of their parent as priority for the point budget
+    candidates = np.arange(len(x) - 1)
+    priority = np.full(len(candidates), np.inf)
+    refine = np.zeros(0, dtype=bool)
+    for _ in range(max_depth):
+        if checkpoint:
+            checkpoint()
+        budget = max_points - len(x)
+        if len(candidates) == 0 or budget <= 0:
+            break
+        if len(candidates) > budget:
+            keep = np.sort(np.argpartition(-priority, budget - 1)[:budget])
+            candidates = candidates[keep]
+            priority = priority[keep]
+
+        x_mid = (x[candidates] + x[candidates + 1]) / 2
+        y_mid = evaluate_graph_chunked(expression, x_mid)
+        y_left, y_right = y[candidates], y[candidates + 1]
+
+        finite = y[np.isfinite(y)]
+        if len(finite):
+            low, high = np.percentile(finite, [5, 95])
+            scale = high - low or max(abs(high), 1.0)
+        else:
+            scale = 1.0
+        with np.errstate(invalid="ignore"):
+            error = np.abs(y_mid - (y_left + y_right) / 2) / scale
+        # A point turning finite/infinite inside the interval means a discontinuity or domain edge
+        edge = (np.isfinite(y_left) != np.isfinite(y_mid)) | (np.isfinite(y_right) != np.isfinite(y_mid))
+        error[edge] = np.inf
+        refine = np.nan_to_num(error, nan=0.0) > tolerance
+
+        # Insert the midpoints; candidate j ends up at position candidates[j] + j + 1
+        x = np.insert(x, candidates + 1, x_mid)
+        y = np.insert(y, candidates + 1, y_mid)
+        positions = candidates + np.arange(len(candidates)) + 1
+        # Both halves of a refined interval are tested in the next round
+        refined = positions[refine]
+        candidates = np.stack([refined - 1, refined], axis=1).ravel()
+        priority = np.repeat(error[refine], 2)
+
+    # Break the line across jumps that never converged
+    if len(candidates):
+        jump = np.abs(y[candidates + 1] - y[candidates])
+        finite = y[np.isfinite(y)]
+        span = np.ptp(finite) if len(finite) else 0.0
+        breaks = candidates[np.nan_to_num(jump, nan=0.0) > 0.25 * span] if span else candidates[:0]
+        if len(breaks):
+            x = np.insert(x, breaks + 1, (x[breaks] + x[breaks + 1]) / 2)
+            y = np.insert(y, breaks + 1, np.nan)
+    return x, y
+
+def decimate_minmax(x, y, width):
+    """
+    Reduce sorted samples to at most four points per pixel column: the first, last,
+    lowest and highest. The drawn line looks the same, but matplotlib only gets a
+    number of points proportional to the canvas width. NaN line breaks are kept.
+    """
+    n = len(x)
+    width = max(int(width), 1)
+    if n <= 4 * width or x[-1] == x[0]:
+        return x, y
+    column = np.clip(((x - x[0]) / (x[-1] - x[0]) * width).astype(np.intp), 0, width - 1)
+    starts = np.flatnonzero(np.r_[True, column[1:] != column[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+
+    # Sorting by (column, y) puts each column's minimum first and NaNs last
+    order = np.lexsort((y, column))
+    finite_count = np.add.reduceat(np.isfinite(y).astype(np.intp), starts)
+    lowest = order[starts]
+    highest = order[starts + np.maximum(finite_count, 1) - 1]
+    has_nan = finite_count < (ends - starts + 1)
+    nan_points = order[ends[has_nan]]
+
+    keep = np.unique(np.concatenate([starts, ends, lowest, highest, nan_points]))
+    return x[keep], y[keep]
+
+def decimate_uniform(x, y, width):
+    """
+    decimate_minmax for evenly spaced samples whose count is a multiple of width:
+    each pixel column is a row of a reshaped array, so no sorting is needed. A NaN
+    in a column takes the place of its lowest and highest point, keeping the break.
+    """
+    width = max(int(width), 1)
+    n = len(x)
+    if n <= 4 * width or n % width:
+        return decimate_minmax(x, y, width)
+    columns = y.reshape(width, -1)
+    starts = np.arange(0, n, n // width)
+    keep = np.unique(np.concatenate([starts, starts + columns.shape[1] - 1,
+                                     starts + columns.argmin(axis=1), starts + columns.argmax(axis=1)]))
+    return x[keep], y[keep]
+
+# ---------------- Sample Tile Cache ----------------
+
+TILES_PER_VIEW = 8  # The visible range is covered by 8 to 16 tiles
+TILE_INITIAL_POINTS = 256
+TILE_MAX_POINTS = 8192
+TILE_CACHE_SIZE = 512
+
+class SampleTileCache:
+    """
+    Adaptive samples stored per (expression, zoom level, tile). Tiles have a width of
+    a power of two aligned to multiples of that width, so panning or a small zoom
+    reuses the tiles already computed and only samples the newly exposed ones.
+    """
+    def __init__(self, max_tiles=TILE_CACHE_SIZE):
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_tile(self, expression, level, index, checkpoint=None):
+        key = (expression, level, index)
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+                self.hits += 1
+                return tile
+            self.misses += 1
+        width = 2.0 ** level
+        tile = sample_adaptive(expression, index * width, (index + 1) * width,
+                               TILE_INITIAL_POINTS, TILE_MAX_POINTS, checkpoint=checkpoint)
+        with self.lock:
+            self.tiles[key] = tile
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+        return tile
+
+    def sample(self, expression, lower, upper, checkpoint=None):
+        lower, upper = min(lower, upper), max(lower, upper)
+        expression = normalize_expression(expression)
+        compile_expression(expression, GRAPH_NAMES)  # Fail before touching the cache
+        if lower == upper or not is_elementwise(expression):
+            return sample_adaptive(expression, lower, upper, checkpoint=checkpoint)
+
+        level = math.floor(math.log2((upper - lower) / TILES_PER_VIEW))
+        width = 2.0 ** level
+        xs, ys = [], []
+        for index in range(math.floor(lower / width), math.ceil(upper / width)):
+            x, y = self.get_tile(expression, level, index, checkpoint)
+            if xs:
+                # Neighbouring tiles share their boundary point
+                x, y = x[1:], y[1:]
+            xs.append(x)
+            ys.append(y)
+        x = np.concatenate(xs)
+        y = np.concatenate(ys)
+        start = np.searchsorted(x, lower, side="left")
+        stop = np.searchsorted(x, upper, side="right")
+        return x[start:stop], y[start:stop]
+
+# ---------------- Surface Tiles ----------------
+
+SURFACE_NAMES = GRAPH_NAMES | {"y"}
+SURFACE_TILE_SIZE = 256  # Samples per tile side; a tile and its temporaries are a few MiB
+SURFACE_CACHE_BYTES = 128 * 2**20
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def _is_surface(expression):
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError:
+        return False
+    return any(isinstance(node, ast.Name) and node.id == "y" for node in ast.walk(tree))
+
+def is_surface(expression):
+    # An expression that uses y is drawn as a heatmap of f(x, y)
+    return _is_surface(normalize_expression(expression))
+
+def evaluate_surface(expression, x, y):
+    """
+    Evaluate f(x, y) where x and y broadcast against each other, e.g. the sparse
+    arrays from np.meshgrid(xs, ys, sparse=True).
+    """
+    shape = np.broadcast_shapes(np.shape(x), np.shape(y))
+    code = compile_expression(expression, SURFACE_NAMES, math.prod(shape) >= INPLACE_MIN_POINTS)
+    z = eval(code, _GRAPH_GLOBALS, {"x": x, "y": y})
+    return np.broadcast_to(z, shape)
+
+def evaluate_surface_tiled(expression, xs, ys, out=None, tile_size=SURFACE_TILE_SIZE, executor=None):
+    """
+    Evaluate f(x, y) on the grid spanned by xs and ys, tile by tile on the thread pool.
+    Only the tiles being worked on have temporaries, so the memory needed beyond out
+    is bounded by the number of threads rather than the size of the grid.
+    """
+    if out is None:
+        out = np.empty((len(ys), len(xs)), dtype=np.float64)
+    if not is_elementwise(expression):
+        out[...] = evaluate_surface(expression, *np.meshgrid(xs, ys, sparse=True))
+        return out
+
+    def evaluate_tile(corner):
+        row, col = corner
+        rows, cols = slice(row, row + tile_size), slice(col, col + tile_size)
+        out[rows, cols] = evaluate_surface(expression, *np.meshgrid(xs[cols], ys[rows], sparse=True))
+
+    corners = [(row, col) for row in range(0, len(ys), tile_size) for col in range(0, len(xs), tile_size)]
+    executor = executor or get_executor()
+    list(executor.map(evaluate_tile, corners))
+    return out
+
+class SurfaceTileCache:
+    """
+    f(x, y) samples stored per (expression, zoom levels, tile), like SampleTileCache
+    but in two dimensions. Tile sides are powers of two aligned to multiples of their
+    size, so after panning or zooming only the newly exposed tiles are evaluated.
+    The cache is limited by the memory the tiles use.
+    """
+    def __init__(self, max_bytes=SURFACE_CACHE_BYTES, tile_size=SURFACE_TILE_SIZE):
+        self.max_bytes = max_bytes
+        self.tile_size = tile_size
+        self.tiles = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _tile(self, key):
+        expression, level_x, level_y, ix, iy = key
+        # Samples sit at the centers of the cells, so neighbouring tiles don't overlap
+        offsets = (np.arange(self.tile_size) + 0.5) / self.tile_size
+        xs = (ix + offsets) * 2.0 ** level_x
+        ys = (iy + offsets) * 2.0 ** level_y
+        tile = np.empty((self.tile_size, self.tile_size), dtype=np.float64)
+        tile[...] = evaluate_surface(expression, *np.meshgrid(xs, ys, sparse=True))
+        return tile
+
+    def get_tiles(self, keys, checkpoint=None):
+        tiles = {}
+        missing = []
+        with self.lock:
+            for key in keys:
+                tile = self.tiles.get(key)
+                if tile is None:
+                    missing.append(key)
+                else:
+                    self.tiles.move_to_end(key)
+                    tiles[key] = tile
+            self.hits += len(tiles)
+            self.misses += len(missing)
+
+        def compute(key):
+            if checkpoint:
+                checkpoint()
+            return self._tile(key)
+
+        # list() waits for all tiles and re-raises the first error, e.g. JobCancelled
+        for key, tile in zip(missing, list(get_executor().map(compute, missing))):
+            tiles[key] = tile
+            with self.lock:
+                if key not in self.tiles:
+                    self.tiles[key] = tile
+                    self.bytes += tile.nbytes
+                while self.bytes > self.max_bytes and self.tiles:
+                    self.bytes -= self.tiles.popitem(last=False)[1].nbytes
+        return tiles
+
+    def render(self, expression, x_range, y_range, width, height, checkpoint=None):
+        """
+        Sample f(x, y) over the view at about one to two samples per pixel. Returns the
+        image (rows are y, first row at the bottom) and its extent (x0, x1, y0, y1).
+        """
+        expression = normalize_expression(expression)
+        compile_expression(expression, SURFACE_NAMES)  # Fail before touching the cache
+        x0, x1 = sorted(x_range)
+        y0, y1 = sorted(y_range)
+        if x0 == x1 or y0 == y1 or not is_elementwise(expression):
+            xs = np.linspace(x0, x1, width)
+            ys = np.linspace(y0, y1, height)
+            return evaluate_surface_tiled(expression, xs, ys), (x0, x1, y0, y1)
+
+        size = self.tile_size
+        # Tile sides are chosen so a sample is at most one pixel wide
+        level_x = math.floor(math.log2((x1 - x0) / max(width, 1) * size))
+        level_y = math.floor(math.log2((y1 - y0) / max(height, 1) * size))
+        tile_w, tile_h = 2.0 ** level_x, 2.0 ** level_y
+        ix0, ix1 = math.floor(x0 / tile_w), math.ceil(x1 / tile_w)
+        iy0, iy1 = math.floor(y0 / tile_h), math.ceil(y1 / tile_h)
+        keys = [(expression, level_x, level_y, ix, iy) for iy in range(iy0, iy1) for ix in range(ix0, ix1)]
+        tiles = self.get_tiles(keys, checkpoint)
+
+        image = np.empty(((iy1 - iy0) * size, (ix1 - ix0) * size), dtype=np.float64)
+        for key in keys:
+            ix, iy = key[3] - ix0, key[4] - iy0
+            image[iy * size:(iy + 1) * size, ix * size:(ix + 1) * size] = tiles[key]
+        # Crop to the cells that overlap the view
+        step_x, step_y = tile_w / size, tile_h / size
+        col0, col1 = math.floor((x0 - ix0 * tile_w) / step_x), math.ceil((x1 - ix0 * tile_w) / step_x)
+        row0, row1 = math.floor((y0 - iy0 * tile_h) / step_y), math.ceil((y1 - iy0 * tile_h) / step_y)
+        extent = (ix0 * tile_w + col0 * step_x, ix0 * tile_w + col1 * step_x,
+                  iy0 * tile_h + row0 * step_y, iy0 * tile_h + row1 * step_y)
+        return image[row0:row1, col0:col1], extent
+
+# ---------------- Implicit Curves ----------------
+
+IMPLICIT_INITIAL_CELLS = 32  # Starting grid per side; features smaller than a cell can be missed
+IMPLICIT_POLE_STEPS = 10  # Bisection steps along a cell edge to tell a zero of F from a pole
+_SINGLE_EQUALS = re.compile(r"(?<![=<>!])=(?!=)")
+
+# Marching squares: corners 0-3 run counterclockwise from the bottom left, edge k joins
+# corner k and corner k+1. For each corner sign pattern, the edges each segment crosses.
+# The two saddle patterns (5 and 10) depend on the sign at the cell center: the first
+# table is for a center <= 0, the second for a center > 0.
+_MARCHING_EDGES = {
+    1: [(3, 0)], 2: [(0, 1)], 3: [(3, 1)], 4: [(1, 2)], 6: [(0, 2)], 7: [(3, 2)], 8: [(2, 3)],
+    9: [(0, 2)], 11: [(1, 2)], 12: [(3, 1)], 13: [(0, 1)], 14: [(3, 0)],
+}
+_SADDLE_EDGES = ({5: [(3, 0), (1, 2)], 10: [(0, 1), (2, 3)]},
+                 {5: [(0, 1), (2, 3)], 10: [(3, 0), (1, 2)]})
+
+def _marching_table():
+    table = np.full((32, 2, 2), -1, dtype=np.intp)
+    for center_positive in (0, 1):
+        cases = {**_MARCHING_EDGES, **_SADDLE_EDGES[center_positive]}
+        for case, segments in cases.items():
+            for slot, edges in enumerate(segments):
+                table[case + 16 * center_positive, slot] = edges
+    return table
+
+_MARCHING_TABLE = _marching_table()
+
+def is_implicit(expression):
+    # An equation with a single "=", like x^2+y^2=1, is drawn as the curve where both sides are equal
+    return len(_SINGLE_EQUALS.findall(expression)) == 1
+
+def implicit_expression(expression):
+    # "x^2+y^2=1" -> F(x, y) = (x^2+y^2)-(1), whose zeros are the curve
+    left, right = _SINGLE_EQUALS.split(expression)
+    return normalize_expression(f"({left})-({right})")
+
+def marching_squares(x0, y0, width, height, corners, center, valid_edges=None):
+    """
+    Line segments where F = 0 inside cells with lower left corners (x0, y0), given
+    F at the four corners (n x 4, counterclockwise from the bottom left) and at the
+    centers. Segments ending on an edge that is False in valid_edges (n x 4, edge k
+    joins corner k and k+1) are left out. Returns an array of shape (segments, 2, 2).
+    """
+    positive = corners > 0
+    case = positive[:, 0] + 2 * positive[:, 1] + 4 * positive[:, 2] + 8 * positive[:, 3] + 16 * (center > 0)
+    px = np.stack([x0, x0 + width, x0 + width, x0], axis=1)
+    py = np.stack([y0, y0, y0 + height, y0 + height], axis=1)
+    # Where each edge crosses zero, by linear interpolation between its corners
+    following = [1, 2, 3, 0]
+    with np.errstate(all="ignore"):
+        t = corners / (corners - corners[:, following])
+        crossings = np.stack([px + t * (px[:, following] - px), py + t * (py[:, following] - py)], axis=2)
+    if valid_edges is not None:
+        crossings[~valid_edges] = np.nan
+    segments = []
+    rows = np.arange(len(case))
+    for slot in (0, 1):
+        edges = _MARCHING_TABLE[case, slot]
+        valid = edges[:, 0] >= 0
+        segments.append(np.stack([crossings[rows[valid], edges[valid, 0]],
+                                  crossings[rows[valid], edges[valid, 1]]], axis=1))
+    segments = np.concatenate(segments)
+    return segments[np.isfinite(segments).all(axis=(1, 2))]
+
+def _pole_edges(evaluate, x0, y0, width, height, corners, steps=IMPLICIT_POLE_STEPS):
+    """
+    The cell edges (n x 4, like marching_squares) where F changes sign by jumping
+    through a pole, as 1/x does, instead of passing through zero. Each sign change is
+    narrowed down by bisection: at a zero |F| shrinks below the edge's end values,
+    at a pole it grows past them.
+    """
+    following = [1, 2, 3, 0]
+    ends = corners[:, following]
+    crossing = (corners > 0) != (ends > 0)
+    px = np.stack([x0, x0 + width, x0 + width, x0], axis=1)
+    py = np.stack([y0, y0, y0 + height, y0 + height], axis=1)
+    ax, ay, fa = px[crossing], py[crossing], corners[crossing]
+    bx, by = px[:, following][crossing], py[:, following][crossing]
+    limit = np.maximum(np.abs(fa), np.abs(ends[crossing]))
+    for _ in range(steps):
+        mx, my = (ax + bx) / 2, (ay + by) / 2
+        fm = evaluate(mx, my)
+        left = (fm > 0) != (fa > 0)
+        bx, by = np.where(left, mx, bx), np.where(left, my, by)
+        ax, ay, fa = np.where(left, ax, mx), np.where(left, ay, my), np.where(left, fa, fm)
+    poles = np.zeros_like(crossing)
+    poles[crossing] = ~(np.abs(evaluate((ax + bx) / 2, (ay + by) / 2)) <= limit)
+    return poles
+
+def implicit_curve(expression, x_range, y_range, resolution, initial_cells=IMPLICIT_INITIAL_CELLS,
+                   checkpoint=None):
+    """
+    Segments of the curve F(x, y) = 0 for an equation like "x^2+y^2=1", with the
+    finest cells about (range / resolution) wide. Starting from a coarse grid, only
+    cells that may contain part of the curve are split into four, level by level,
+    so the work follows the length of the curve rather than the area of the view.
+    F also changes sign across a pole (y=1/x, y=tan(x)); such crossings are found by
+    bisection along the cell edges and left out, so the result doesn't depend on how
+    the equation is written. A pole within about range / (resolution * 2**IMPLICIT_POLE_STEPS)
+    of a grid corner can still slip through.
+    """
+    function = implicit_expression(expression)
+    compile_expression(function, SURFACE_NAMES)
+
+    def evaluate(x, y):
+        # Points outside the domain (sqrt of a negative, ...) become nan and never hold the curve
+        with np.errstate(all="ignore"):
+            return np.asarray(evaluate_surface(function, x, y), dtype=np.float64)
+
+    x_low, x_high = sorted(x_range)
+    y_low, y_high = sorted(y_range)
+    depth = max(0, math.ceil(math.log2(max(resolution, 1) / initial_cells)))
+    width = (x_high - x_low) / initial_cells
+    height = (y_high - y_low) / initial_cells
+
+    # Corner values of the starting grid are shared between neighbouring cells
+    xs = np.linspace(x_low, x_high, initial_cells + 1)
+    ys = np.linspace(y_low, y_high, initial_cells + 1)
+    grid = np.empty((initial_cells + 1, initial_cells + 1))
+    grid[...] = evaluate(*np.meshgrid(xs, ys, sparse=True))
+    col, row = [a.ravel() for a in np.meshgrid(np.arange(initial_cells), np.arange(initial_cells))]
+    x0, y0 = xs[col], ys[row]
+    corners = np.stack([grid[row, col], grid[row, col + 1], grid[row + 1, col + 1], grid[row + 1, col]], axis=1)
+    center = evaluate(x0 + width / 2, y0 + height / 2)
+
+    with np.errstate(invalid="ignore"):  # ptp and comparisons of nan
+        for level in range(depth + 1):
+            if checkpoint:
+                checkpoint()
+            samples = np.column_stack([corners, center])
+            sign_change = (samples > 0).any(axis=1) & (samples <= 0).any(axis=1)
+            if level == depth:
+                keep = (corners > 0).any(axis=1) & (corners <= 0).any(axis=1)
+                x0, y0, corners, center = x0[keep], y0[keep], corners[keep], center[keep]
+                valid_edges = ~_pole_edges(evaluate, x0, y0, width, height, corners)
+                break
+            # Interval check: without a sign change, keep a cell if F varies across it by
+            # more than its distance from zero, so it could still touch zero between samples
+            near_zero = np.abs(samples).min(axis=1) <= np.ptp(samples, axis=1)
+            keep = sign_change | near_zero
+            x0, y0, corners, center = x0[keep], y0[keep], corners[keep], center[keep]
+
+            # Split every kept cell in four: evaluate the edge midpoints and the child centers
+            w, h = width / 2, height / 2
+            px = np.concatenate([x0 + w, x0 + width, x0 + w, x0,
+                                 x0 + w / 2, x0 + 3 * w / 2, x0 + 3 * w / 2, x0 + w / 2])
+            py = np.concatenate([y0, y0 + h, y0 + height, y0 + h,
+                                 y0 + h / 2, y0 + h / 2, y0 + 3 * h / 2, y0 + 3 * h / 2])
+            bottom, right, top, left, *centers = np.split(evaluate(px, py), 8)
+            c0, c1, c2, c3 = corners.T
+            corners = np.concatenate([
+                np.stack([c0, bottom, center, left], axis=1),
+                np.stack([bottom, c1, right, center], axis=1),
+                np.stack([center, right, c2, top], axis=1),
+                np.stack([left, center, top, c3], axis=1),
+            ])
+            center = np.concatenate(centers)
+            x0 = np.concatenate([x0, x0 + w, x0 + w, x0])
+            y0 = np.concatenate([y0, y0, y0 + h, y0 + h])
+            width, height = w, h
+    return marching_squares(x0, y0, width, height, corners, center, valid_edges)
+
+# ---------------- Parameters ----------------
+
+PARAMETER_POINTS = 200_000  # Samples per parameter sweep; the x-only parts are computed once per grid
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def _free_parameters(expression):
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError:
+        return ()
+    # Names used as functions are left alone, so unknown functions are still reported as errors
+    functions = {node.func.id for node in ast.walk(tree) if isinstance(node, ast.Call)
+                 and isinstance(node.func, ast.Name)}
+    # _ names are reserved for the compiled code (_t0, _x, _invariant) and stay unknown names
+    names = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and not node.id.startswith("_")}
+    return tuple(sorted(names - functions - SURFACE_NAMES))
+
+def free_parameters(expression):
+    # Names in a graph expression besides x and y, e.g. ("a", "b") for "a*sin(b*x)"
+    return _free_parameters(normalize_expression(expression))
+
+class _HoistInvariant(ast.NodeTransformer):
+    """
+    Replaces the largest subtrees that use x but none of the parameters with
+    _invariant[i], and collects them so they can be evaluated once per grid.
+    """
+    def __init__(self, parameters):
+        self.parameters = set(parameters)
+        self.hoisted = []
+
+    def visit(self, node):
+        if isinstance(node, _CSE_NODES):
+            names = {child.id for child in ast.walk(node) if isinstance(child, ast.Name)}
+            if "x" in names and not names & self.parameters:
+                self.hoisted.append(ast.unparse(node))
+                return ast.Subscript(ast.Name("_invariant", ast.Load()),
+                                     ast.Constant(len(self.hoisted) - 1), ast.Load())
+        return self.generic_visit(node)
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def _compile_parametric(expression, parameters):
+    tree = ast.parse(expression, mode="eval")
+    validate_expression(tree, GRAPH_NAMES | set(parameters))
+    tree = _FoldConstants().visit(tree)
+    hoist = _HoistInvariant(parameters)
+    body = ast.unparse(hoist.visit(tree.body))
+    # Generated from a validated tree only, like _compile_batch
+    source = (f"def _invariant_parts(x):\n    return ({''.join(part + ', ' for part in hoist.hoisted)})\n"
+              f"def _parametric(x, _invariant, {', '.join(parameters)}):\n    return {body}\n")
+    namespace = dict(_GRAPH_GLOBALS)
+    exec(compile(source, "<parametric>", "exec"), namespace)
+    return namespace["_invariant_parts"], namespace["_parametric"]
+
+class ParametricExpression:
+    """
+    A graph expression with free parameters, e.g. "a*sin(x)+b*exp(-x^2)". It is
+    compiled once with the parameters as arguments, and the parts that only depend
+    on x (sin(x) and exp(-x**2) here) are evaluated once per grid, so moving a
+    parameter slider only recomputes what the parameters change. Hot sweeps run
+    on a compiled kernel instead where graph_kernels found one to be faster.
+    """
+    def __init__(self, expression):
+        self.expression = normalize_expression(expression)
+        self.parameters = free_parameters(self.expression)
+        self.invariant_parts, self.parametric = _compile_parametric(self.expression, self.parameters)
+        self.grid = None  # ((lower, upper, num_points), x, invariant parts)
+        self.lock = threading.Lock()
+
+    def evaluate(self, lower, upper, values, num_points=PARAMETER_POINTS):
+        """
+        Returns x, a uniform grid over [lower, upper], and f(x) for the given
+        parameter values (a dict of name -> number).
+        """
+        key = (lower, upper, num_points)
+        with self.lock:
+            grid = self.grid
+        if grid is None or grid[0] != key:
+            x = np.linspace(lower, upper, num_points)
+            with np.errstate(all="ignore"):
+                grid = (key, x, self.invariant_parts(x))
+            with self.lock:
+                self.grid = grid
+        key, x, invariant = grid
+        values = [float(values[name]) for name in self.parameters]
+        kernel = graph_kernels.jit_kernel(self.expression, self.parameters, num_points)
+        with np.errstate(all="ignore"):
+            if kernel is not None:
+                # A hot sweep that compiles to a faster single loop over x
+                y = np.empty_like(x)
+                kernel(x, y, *values)
+                return x, y
+            y = self.parametric(x, invariant, *values)
+        return x, np.broadcast_to(y, x.shape)
+
+@functools.lru_cache(maxsize=16)
+def parametric_expression(expression):
+    # One instance per expression, so its cached grid survives between slider moves
+    return ParametricExpression(expression)
+
+# ---------------- Numeric Analysis ----------------
+
+GAUSS_PANELS = 64  # Composite Gauss-Legendre rule: panels of GAUSS_ORDER nodes each, doubled until it converges
+GAUSS_MAX_PANELS = 4096
+GAUSS_ORDER = 16
+INTEGRAL_TOLERANCE = 1e-10  # Relative to the integral of |f|
+ANALYSIS_ITERATIONS = 64  # Bisection and golden-section steps, enough for double precision
+_GOLDEN = (math.sqrt(5) - 1) / 2
+
+@functools.lru_cache(maxsize=None)
+def _gauss_legendre(panels, order):
+    # Nodes and weights on [0, 1], computed once per rule and scaled to each interval
+    nodes, weights = np.polynomial.legendre.leggauss(order)
+    starts = np.arange(panels) / panels
+    nodes = (starts[:, None] + (nodes + 1) / (2 * panels)).ravel()
+    weights = np.tile(weights / (2 * panels), panels)
+    return nodes, weights
+
+def _gauss_rule(expression, lower, upper, panels):
+    # The integral of f and of |f| from one vectorized evaluation at the nodes
+    nodes, weights = _gauss_legendre(panels, GAUSS_ORDER)
+    with np.errstate(all="ignore"):
+        y = evaluate_graph(expression, lower + (upper - lower) * nodes)
+    return float((upper - lower) * np.dot(weights, y)), float(abs(upper - lower) * np.dot(weights, np.abs(y)))
+
+def integrate_numeric(expression, lower, upper, tolerance=INTEGRAL_TOLERANCE):
+    """
+    Definite integral of a graph expression over [lower, upper], an estimate of its
+    error and the integral of |f|. The number of Gauss-Legendre panels is doubled
+    until two successive results agree within tolerance (relative to the integral of
+    |f|), or until GAUSS_MAX_PANELS; the difference of the last two is the error
+    estimate, so fast oscillations like sin(100*x)**2 are refined instead of silently
+    aliased. All three are NaN if f is undefined at any node.
+    """
+    panels = GAUSS_PANELS
+    previous, _ = _gauss_rule(expression, lower, upper, panels)
+    while True:
+        panels *= 2
+        integral, scale = _gauss_rule(expression, lower, upper, panels)
+        error = abs(integral - previous)
+        if not error > tolerance * scale or panels >= GAUSS_MAX_PANELS:
+            return integral, error, scale
+        previous = integral
+
+def _bisect(expression, a, b, fa):
+    # Narrows every bracket [a, b] with a sign change at once; fa = f(a)
+    for _ in range(ANALYSIS_ITERATIONS):
+        m = (a + b) / 2
+        if np.all((m == a) | (m == b)):
+            break
+        fm = evaluate_graph(expression, m)
+        left = np.signbit(fm) != np.signbit(fa)
+        b = np.where(left, m, b)
+        a = np.where(left, a, m)
+        fa = np.where(left, fa, fm)
+    return (a + b) / 2
+
+def _golden_section(expression, a, b, sign):
+    # Narrows every bracket [a, b] around a maximum of sign * f at once
+    c = b - _GOLDEN * (b - a)
+    d = a + _GOLDEN * (b - a)
+    fc = sign * evaluate_graph(expression, c)
+    fd = sign * evaluate_graph(expression, d)
+    for _ in range(ANALYSIS_ITERATIONS):
+        if np.all(b - a <= 1e-15 * np.maximum(np.abs(a), np.abs(b))):
+            break
+        # Keep the side with the higher inner point; its other inner point is reused
+        left = fc > fd
+        a, b = np.where(left, a, c), np.where(left, d, b)
+        new = np.where(left, b - _GOLDEN * (b - a), a + _GOLDEN * (b - a))
+        f_new = sign * evaluate_graph(expression, new)
+        c, d = np.where(left, new, d), np.where(left, c, new)
+        fc, fd = np.where(left, f_new, fd), np.where(left, fc, f_new)
+    return (a + b) / 2
+
+def _extrema(expression, x, y, sign):
+    # Interior samples higher (sign=1) or lower (sign=-1) than both neighbours
+    slope = sign * np.diff(y)
+    peaks = np.flatnonzero((slope[:-1] > 0) & (slope[1:] < 0)) + 1
+    if len(peaks) == 0:
+        return np.zeros(0), np.zeros(0)
+    x_peak = _golden_section(expression, x[peaks - 1], x[peaks + 1], sign)
+    y_peak = evaluate_graph(expression, x_peak)
+    # The refined value stays near the samples, unless the bracket held a pole instead
+    spread = np.abs(y[peaks + 1] - y[peaks]) + np.abs(y[peaks] - y[peaks - 1])
+    keep = np.abs(y_peak - y[peaks]) <= spread
+    return x_peak[keep], y_peak[keep]
+
+def analyze_graph(expression, x, y, lower, upper):
+    """
+    Roots, local minima and maxima of f and its integral over [lower, upper].
+    Sign changes in the plotted samples x, y bracket the roots, and sign changes of
+    their slope the extrema; all brackets are then narrowed together by vectorized
+    bisection and golden-section search. Returns a dict with "roots", "minima" and
+    "maxima" (arrays of x, and of x and y for the extrema), "integral", its
+    "integral_error" estimate and "integral_scale" (the integral of |f|), or None for
+    expressions that can't be evaluated at arbitrary points (see is_elementwise).
+    The integral is NaN where f is undefined or has a pole somewhere in the range.
+    """
+    expression = normalize_expression(expression)
+    if not is_elementwise(expression):
+        return None
+    with np.errstate(all="ignore"):
+        # Brackets between finite samples of opposite sign; samples that are exactly 0 are roots
+        finite = np.isfinite(y)
+        sign = np.sign(y)
+        brackets = np.flatnonzero(finite[:-1] & finite[1:] & (sign[:-1] * sign[1:] < 0))
+        roots = _bisect(expression, x[brackets], x[brackets + 1], y[brackets])
+        # A sign change across a pole (tan(x) at pi/2) narrows down to a huge value
+        limit = np.minimum(np.abs(y[brackets]), np.abs(y[brackets + 1]))
+        roots = roots[np.abs(evaluate_graph(expression, roots)) <= limit]
+        roots = np.union1d(roots, x[y == 0])
+        minima = _extrema(expression, x, y, -1)
+        maxima = _extrema(expression, x, y, 1)
+    # Poles and gaps show up as non-finite samples; quadrature would return a finite number anyway
+    integral, error, scale = integrate_numeric(expression, lower, upper) if finite.all() else (math.nan,) * 3
+    return {"roots": roots, "minima": minima, "maxima": maxima,
+            "integral": integral, "integral_error": error, "integral_scale": scale}
+
+# ---------------- Latest-Wins Job Pool ----------------
+
+class JobCancelled(Exception):
+    pass
+
+_current_job = threading.local()
+
+def current_token():
+    # The JobToken of the job running on this thread, or None outside the job pool
+    return getattr(_current_job, "token", None)
+
+class JobToken:
+    """
+    Handed to every job. A job is cancelled as soon as a newer job is submitted on
+    its channel; long jobs call check() now and then to stop early.
+    """
+    def __init__(self, pool, channel, generation):
+        self.pool = pool
+        self.channel = channel
+        self.generation = generation
+
+    def cancelled(self):
+        return self.pool.generations[self.channel] != self.generation
+
+    def check(self):
+        if self.cancelled():
+            raise JobCancelled()
+
+class LatestJobPool:
+    """
+    Long-lived worker threads for jobs where only the newest request per channel
+    (e.g. "calc" or "graph") matters. Superseded jobs are skipped if they haven't
+    started, stop at their next token.check() if they have, and their result is
+    never delivered.
+    """
+    def __init__(self, max_workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="calculator-job")
+        self.generations = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def submit(self, channel, func, *args, on_done):
+        """
+        Run func(*args, token) on a worker. on_done(token, result) is called from the
+        worker thread with the return value or the raised exception, unless the job
+        was superseded. Callers on another thread should check token.cancelled() again
+        when the result arrives.
+        """
+        with self.lock:
+            self.generations[channel] += 1
+            token = JobToken(self, channel, self.generations[channel])
+
+        def run():
+            if token.cancelled():
+                return
+            _current_job.token = token
+            try:
+                result = func(*args, token)
+            except JobCancelled:
+                return
+            except Exception as e:
+                result = e
+            finally:
+                _current_job.token = None
+            if not token.cancelled():
+                on_done(token, result)
+
+        self.executor.submit(run)
+        return token
+
+    def cancel(self, channel):
+        with self.lock:
+            self.generations[channel] += 1
+
+    def shutdown(self):
+        with self.lock:
+            for channel in self.generations:
+                self.generations[channel] += 1
+        self.executor.shutdown(wait=False, cancel_futures=True)
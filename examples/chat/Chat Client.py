@@ -1,23 +1,140 @@
 import sys
-import socket
-import threading
-import json
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QTextEdit, QLineEdit, QPushButton, QLabel, QHBoxLayout
-from PyQt5.QtCore import pyqtSignal, QObject
+import os
+import sqlite3
+from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QListView, QLineEdit, QPushButton, QLabel, QHBoxLayout
+from PyQt5.QtCore import Qt, QTimer, QAbstractListModel, QModelIndex
+from PyQt5.QtNetwork import QAbstractSocket, QTcpSocket, QSslSocket, QSslCertificate, QSsl
+from chat_tls import CERT_FILE
+from chat_core import ChatCore
 
-class Signal(QObject):
-    received = pyqtSignal(str)
+MAX_SCROLLBACK = 5000  # Older messages are dropped from the view
+FRAME_INTERVAL_MS = 16  # Incoming messages are inserted at most once per frame
 
-class ChatClient(QWidget):
+def get_config_folder():
+    if os.name == 'nt':
+        folder = os.path.join(os.getenv('APPDATA'), "ChatClient")
+    else:
+        base_dir = os.getenv('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser("~"), ".config")
+        folder = os.path.join(base_dir, "chat_client")
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return folder
+
+class MessageCache:
+    # Received messages stored per server, seq is the primary key so the tail and the
+    # last seen seq are index lookups no matter how long the history is
     def __init__(self, host, port):
+        path = os.path.join(get_config_folder(), f"messages_{host}_{port}.db")
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS messages ("
+                        "seq INTEGER PRIMARY KEY, sender TEXT, message TEXT, timestamp TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+
+    def epoch(self):
+        # The server history the cached seqs belong to
+        row = self.db.execute("SELECT value FROM settings WHERE key = 'epoch'").fetchone()
+        return row[0] if row else None
+
+    def reset(self, epoch):
+        with self.db:
+            self.db.execute("DELETE FROM messages")
+            self.db.execute("INSERT OR REPLACE INTO settings VALUES ('epoch', ?)", (epoch,))
+
+    def lastSeq(self):
+        return self.db.execute("SELECT MAX(seq) FROM messages").fetchone()[0] or 0
+
+    def tail(self, limit):
+        rows = self.db.execute("SELECT seq, sender, message, timestamp FROM messages "
+                               "ORDER BY seq DESC LIMIT ?", (limit,)).fetchall()
+        return [{'seq': seq, 'sender': sender, 'message': message, 'timestamp': timestamp}
+                for seq, sender, message, timestamp in reversed(rows)]
+
+    def addMessages(self, messages):
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO messages VALUES (:seq, :sender, :message, :timestamp)", messages)
+
+    def close(self):
+        self.db.close()
+
+class MessageListModel(QAbstractListModel):
+    # The view only asks for the rows that are visible, so the size of the history doesn't matter
+    def __init__(self, max_messages=MAX_SCROLLBACK, parent=None):
+        super().__init__(parent)
+        self.max_messages = max_messages
+        self.messages = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.messages)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return self.messages[index.row()]
+        return None
+
+    def appendMessages(self, messages):
+        # One remove and one insert per batch instead of one relayout per message
+        messages = messages[-self.max_messages:]
+        overflow = len(self.messages) + len(messages) - self.max_messages
+        if overflow > 0:
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+            del self.messages[:overflow]
+            self.endRemoveRows()
+        first = len(self.messages)
+        self.beginInsertRows(QModelIndex(), first, first + len(messages) - 1)
+        self.messages.extend(messages)
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.messages = []
+        self.endResetModel()
+
+class ChatClient(QWidget):
+    def __init__(self, host, port, use_tls=False):
         super().__init__()
         self.host = host
         self.port = port
+        self.use_tls = use_tls
+        self.tls_session = None  # Reused on reconnect to skip the full handshake
+        self.pendingMessages = []  # Messages waiting for the next frame
+        self.closing = False
+        self.cache = MessageCache(host, port)
+        self.unsavedMessages = []  # Written to the cache once per frame
+
+        # The protocol lives in ChatCore, this widget only moves bytes and shows messages
+        self.core = ChatCore(last_seq=self.cache.lastSeq(), epoch=self.cache.epoch(),
+                             call_later=lambda delay, callback: QTimer.singleShot(int(delay * 1000), callback))
+        self.core.on('chat', self.handleChatMessage)
+        self.core.on('system', self.handleSystemMessage)
+        self.core.on('notification', self.handleNotification)
+        self.core.on('error', self.handleError)
+        self.core.on('auth_failed', self.handleAuthFailed)
+        self.core.on('epoch', self.handleNewEpoch)
         self.initUI()
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # In your client's init method
-        self.signal = Signal()
-        self.signal.received.connect(self.updateChat)
+        self.loadCachedMessages()
+
+        self.reconnectTimer = QTimer(self)
+        self.reconnectTimer.setSingleShot(True)
+        self.reconnectTimer.timeout.connect(self.reconnect)
+
+        # The socket lives on the GUI thread, Qt calls us back when data arrives
+        if use_tls:
+            self.socket = QSslSocket(self)
+            config = self.socket.sslConfiguration()
+            # The server certificate is generated locally, copy server.crt next to the client
+            config.setCaCertificates(QSslCertificate.fromPath(CERT_FILE))
+            config.setSslOption(QSsl.SslOptionDisableSessionPersistence, False)
+            self.socket.setSslConfiguration(config)
+            self.socket.encrypted.connect(self.onConnected)
+            self.socket.newSessionTicketReceived.connect(self.storeSessionTicket)
+        else:
+            self.socket = QTcpSocket(self)
+            self.socket.connected.connect(self.onConnected)
+        self.socket.readyRead.connect(self.onReadyRead)
+        self.socket.disconnected.connect(self.onDisconnected)
+        self.socket.errorOccurred.connect(self.onSocketError)
 
     def initUI(self):
         self.setWindowTitle('Chat Client')
@@ -28,9 +145,18 @@ class ChatClient(QWidget):
         self.chatLabel = QLabel('Chat Messages')
         self.layout.addWidget(self.chatLabel)
 
-        self.chatTextEdit = QTextEdit()
-        self.chatTextEdit.setReadOnly(True)
-        self.layout.addWidget(self.chatTextEdit)
+        self.chatModel = MessageListModel(parent=self)
+        self.chatView = QListView()
+        self.chatView.setModel(self.chatModel)
+        # Every row has the same height, so Qt can lay out only the visible rows
+        self.chatView.setUniformItemSizes(True)
+        self.chatView.setEditTriggers(QListView.NoEditTriggers)
+        self.layout.addWidget(self.chatView)
+
+        self.flushTimer = QTimer(self)
+        self.flushTimer.setSingleShot(True)
+        self.flushTimer.setInterval(FRAME_INTERVAL_MS)
+        self.flushTimer.timeout.connect(self.flushMessages)
 
         self.messageLineEdit = QLineEdit()
         self.layout.addWidget(self.messageLineEdit)
@@ -40,79 +166,121 @@ class ChatClient(QWidget):
         self.layout.addWidget(self.sendButton)
 
         self.show()
-        
+
+    def formatChatMessage(self, message_data):
+        sender = message_data.get('sender', 'Unknown')
+        timestamp = message_data.get('timestamp', 'Unknown Time')
+        content = message_data.get('message', '')  # Make sure this key matches what the server sends
+        return f"{sender} [{timestamp}]: {content}"
+
+    def loadCachedMessages(self):
+        # Show the end of the history right away, the server only sends what came after it
+        messages = self.cache.tail(MAX_SCROLLBACK)
+        if messages:
+            self.chatModel.appendMessages([self.formatChatMessage(message_data) for message_data in messages])
+            self.chatView.scrollToBottom()
+
     def updateChat(self, message):
-        self.chatTextEdit.append(message)
+        self.pendingMessages.append(message)
+        if not self.flushTimer.isActive():
+            self.flushTimer.start()
+
+    def flushMessages(self):
+        if not self.pendingMessages:
+            return
+        scrollBar = self.chatView.verticalScrollBar()
+        # Only follow new messages if the user hasn't scrolled up
+        atBottom = scrollBar.value() == scrollBar.maximum()
+        self.chatModel.appendMessages(self.pendingMessages)
+        self.pendingMessages = []
+        if atBottom:
+            self.chatView.scrollToBottom()
+        if self.unsavedMessages:
+            self.cache.addMessages(self.unsavedMessages)
+            self.unsavedMessages = []
 
     def connectToServer(self, username, password):
-        self.socket.connect((self.host, self.port))
-        login_data = json.dumps({'action': 'login', 'username': username, 'password': password})
-        self.socket.send(login_data.encode())
-        threading.Thread(target=self.receiveMessages, daemon=True).start()
-
-
-    def receiveMessages(self):
-        while True:
-            try:
-                message = self.socket.recv(1024).decode()
-                print(f"Raw message received: {message}")  # Log raw message data
-                if message:
-                    message_data = json.loads(message)
-                    # Handle non-chat type messages like authentication responses
-                    if 'response' in message_data:
-                        if message_data['response'] == 'authentication_failed':
-                            print("Authentication failed. Please check your credentials.")
-                            # Update the GUI or take other actions as needed
-                            self.signal.received.emit("Authentication failed. Please check your credentials.")
-                        continue  # Skip further processing for this message
-
-                    message_type = message_data.get('type')
-                    if message_type == 'chat':
-                        self.handleChatMessage(message_data)
-                    elif message_type == 'system':
-                        self.handleSystemMessage(message_data)
-                    # Add other message types as needed
-                    else:
-                        print(f"Unknown message type: {message_type}")
-            except Exception as e:
-                print(f"Error receiving message: {e}")
-                break
-
-
-    def sendAcknowledgment(self, message_id):
-        ack_message = json.dumps({'action': 'ack', 'id': message_id})
-        try:
-            self.socket.send(ack_message.encode())
-        except Exception as e:
-            print(f"Error sending acknowledgment: {e}")
+        # Returns immediately, the login is sent from onConnected
+        self.core.username = username
+        self.core.password = password
+        if self.use_tls:
+            if self.tls_session:
+                config = self.socket.sslConfiguration()
+                config.setSessionTicket(self.tls_session)
+                self.socket.setSslConfiguration(config)
+            # The generated certificate is issued for localhost
+            self.socket.connectToHostEncrypted(self.host, self.port, 'localhost')
+        else:
+            self.socket.connectToHost(self.host, self.port)
+
+    def onConnected(self):
+        self.socket.setSocketOption(QAbstractSocket.LowDelayOption, 1)
+        # Qt buffers the writes and sends them when the socket is ready
+        self.core.connection_made(self.socket.write)
+
+    def storeSessionTicket(self):
+        # Session tickets arrive after the handshake, keep the latest one
+        self.tls_session = self.socket.sslConfiguration().sessionTicket()
+
+    def onDisconnected(self):
+        self.core.connection_lost()
+        if not self.closing:
+            self.updateChat("Disconnected from server.")
+            self.scheduleReconnect()
+
+    def onSocketError(self, error):
+        if error != QAbstractSocket.RemoteHostClosedError:
+            self.updateChat(f"Connection error: {self.socket.errorString()}")
+        # A failed connect never emits disconnected, so retry from here as well
+        if self.socket.state() == QAbstractSocket.UnconnectedState and not self.closing:
+            self.scheduleReconnect()
 
+    def scheduleReconnect(self):
+        if self.reconnectTimer.isActive():
+            return
+        delay = self.core.next_reconnect_delay()
+        self.updateChat(f"Reconnecting in {delay:.1f} s...")
+        self.reconnectTimer.start(int(delay * 1000))
+
+    def reconnect(self):
+        if self.socket.state() != QAbstractSocket.UnconnectedState:
+            self.socket.abort()
+        self.connectToServer(self.core.username, self.core.password)
+
+    def onReadyRead(self):
+        self.core.feed(bytes(self.socket.readAll()))
 
     def sendMessage(self):
         message = self.messageLineEdit.text()
         if message:
-            # Check if the socket is connected
-            try:
-                # This is a way to check if the socket is still open
-                self.socket.send(json.dumps({'action': 'message', 'message': message}).encode())
-                self.messageLineEdit.clear()
-            except OSError:
-                print("Socket is closed or not valid.")
-                return  # Exit the function if the socket is closed
-            
+            # Messages are queued and sent by the network layer, or kept until we are logged in again
+            if not self.core.send_message(message):
+                self.updateChat("Offline buffer is full, dropped the oldest unsent message.")
+            self.messageLineEdit.clear()
+
     def handleChatMessage(self, message_data):
-        sender = message_data.get('sender', 'Unknown')
-        timestamp = message_data.get('timestamp', 'Unknown Time')
-        content = message_data.get('message', '')  # Make sure this key matches what the server sends
+        # The core has already dropped messages we have in the cache
+        seq = message_data.get('seq')
+        if seq is not None:
+            self.unsavedMessages.append({'seq': seq, 'sender': message_data.get('sender', 'Unknown'),
+                                         'message': message_data.get('message', ''),
+                                         'timestamp': message_data.get('timestamp', 'Unknown Time')})
         # Update the chat window with the new message
-        self.signal.received.emit(f"{sender} [{timestamp}]: {content}")
+        self.updateChat(self.formatChatMessage(message_data))
+
+    def handleNewEpoch(self, message_data):
+        # The server's history was reset, the cached messages are replaced by its history
+        self.flushMessages()
+        self.cache.reset(message_data.get('epoch'))
+        self.chatModel.clear()
 
-        # Send acknowledgment back to the server
-        # self.sendAcknowledgment(message_id)
+    def handleAuthFailed(self, message_data):
+        self.updateChat("Authentication failed. Please check your credentials.")
 
     def handleSystemMessage(self, message_data):
         # Handle system messages, possibly update GUI or log
         content = message_data.get('content', '')
-        self.signal.received.emit(f"System: {content}")
+        self.updateChat(f"System: {content}")
 
     def handleError(self, message_data):
         # Handle error messages, possibly show an error dialog or notification
@@ -122,8 +290,16 @@ class ChatClient(QWidget):
     def handleNotification(self, message_data):
         # Handle notifications, such as user joined/left, etc.
         content = message_data.get('content', '')
-        self.signal.received.emit(f"Notification: {content}")
-    
+        self.updateChat(f"Notification: {content}")
+
+    def closeEvent(self, event):
+        self.closing = True
+        self.reconnectTimer.stop()
+        self.socket.disconnectFromHost()
+        self.flushMessages()
+        self.cache.close()
+        event.accept()
+
 
 
 if __name__ == '__main__':
@@ -134,8 +310,9 @@ if __name__ == '__main__':
     server_port = 12345
     username = 'your_username2'
     password = 'your_password'
+    use_tls = '--tls' in sys.argv  # Must match the server
 
-    chat_client = ChatClient(server_ip, server_port)
+    chat_client = ChatClient(server_ip, server_port, use_tls)
     chat_client.connectToServer(username, password)
 
     sys.exit(app.exec_())
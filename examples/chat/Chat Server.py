@@ -3,15 +3,27 @@ import socket
 import threading
 import json
 import datetime
-import time
+import queue
+import uuid
+import select
+import ssl
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QTextEdit, QLabel
 from PyQt5.QtCore import pyqtSignal, QObject
 import os
+from chat_tls import load_or_create_certificate, create_server_context, server_handshake, HandshakeMetrics
 
 
 # Global Variables
 clients = []
 user_data = {}  # To store user data like {username: {'ip': '...', 'port': ..., 'password': '...'}}
+USE_TLS = '--tls' in sys.argv  # Run with --tls to encrypt connections (passwords are sent in the login message)
+tls_metrics = HandshakeMetrics()
+history = []  # Every chat message, the message with seq n is stored at history[n - 1]
+history_lock = threading.Lock()  # Keeps seq numbers, the history and the send queues in the same order
+SYNC_LIMIT = 1000  # Most messages sent to a client that is catching up
+SEND_QUEUE_LIMIT = 10000  # Frames waiting for a slow client before it is disconnected
+SEND_TIMEOUT = 30  # Seconds a client may accept no data at all before it is disconnected
+SEND_CHUNK = 65536  # Bytes written per send, larger writes are split over several
 
 
 
@@ -37,6 +49,97 @@ def load_or_create_credentials(file_name='credentials.json'):
 # At the start of your server script, after defining the function
 user_data = load_or_create_credentials()
 
+def load_history(file_name='chat_history.jsonl'):
+    if not os.path.exists(file_name):
+        return []
+    with open(file_name, 'r') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+def append_history(message, file_name='chat_history.jsonl'):
+    with open(file_name, 'a') as file:
+        file.write(json.dumps(message) + '\n')
+
+def load_epoch(history, file_name='chat_history.epoch'):
+    # Identifies the history the seqs count in. A new history gets a new epoch,
+    # so clients know their cached seqs no longer apply.
+    if history and os.path.exists(file_name):
+        with open(file_name, 'r') as file:
+            return file.read().strip()
+    epoch = uuid.uuid4().hex
+    with open(file_name, 'w') as file:
+        file.write(epoch)
+    return epoch
+
+history = load_history()
+epoch = load_epoch(history)
+
+def encode_frame(data):
+    # Every message is one line of JSON so the receiver can split a stream back into messages
+    return (json.dumps(data) + '\n').encode()
+
+def queue_frame(client_info, frame):
+    # Never blocks, so one slow client can't hold up the sender or the history lock.
+    # A client that falls too far behind is disconnected and catches up when it reconnects.
+    try:
+        client_info['message_queue'].put_nowait(frame)
+    except queue.Full:
+        print(f"Send queue of {client_info['username']} at {client_info['address']} is full, disconnecting")
+        client_info['dropped'] = True
+    try:
+        # Wakes the client's thread, which does the actual write
+        client_info['wakeup'].send(b'\0')
+    except OSError:
+        pass  # A wakeup is already pending, or the client is gone
+
+def send_json(client_info, data):
+    queue_frame(client_info, encode_frame(data))
+
+def read_frames(client_info):
+    # Yields the messages the client sends and writes its queued frames in between.
+    # Only the client's own thread uses its socket: an SSLSocket must not be read
+    # and written from different threads at the same time. The socket is non-blocking,
+    # so a client that doesn't read can't stop us from reading what it sends.
+    client_socket = client_info['client']
+    client_socket.setblocking(False)
+    wakeup = client_info['wakeup_reader']
+    buffer = b''
+    outgoing = bytearray()
+    while True:
+        # Data OpenSSL has already decrypted doesn't make the socket readable
+        pending = isinstance(client_socket, ssl.SSLSocket) and client_socket.pending()
+        readable, writable, _ = select.select([client_socket, wakeup], [client_socket] if outgoing else [], [],
+                                              0 if pending else SEND_TIMEOUT)
+        if outgoing and not (pending or readable or writable):
+            return  # The client hasn't accepted any data for SEND_TIMEOUT seconds
+        if wakeup in readable:
+            wakeup.recv(4096)
+        if client_info.get('dropped'):
+            return
+        while True:
+            try:
+                outgoing += client_info['message_queue'].get_nowait()
+            except queue.Empty:
+                break
+        if outgoing:
+            try:
+                del outgoing[:client_socket.send(outgoing[:SEND_CHUNK])]
+            except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                pass  # Sent once the socket is writable again
+        if not (pending or client_socket in readable):
+            continue
+        # A single recv may hold several messages or only part of one
+        try:
+            chunk = client_socket.recv(4096)
+        except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            continue  # Only part of a TLS record has arrived
+        if not chunk:
+            return
+        buffer += chunk
+        *frames, buffer = buffer.split(b'\n')
+        for frame in frames:
+            if frame.strip():
+                yield json.loads(frame)
+
 # Signal class for updating the GUI from a different thread
 class Signal(QObject):
     signal = pyqtSignal(str)
@@ -64,21 +167,48 @@ class ServerGUI(QWidget):
     def logMessage(self, message):
         self.logTextEdit.append(message)
 
+def add_client(client_info, username, after=None, client_epoch=None):
+    # Broadcasts queue their frames under the same lock, so each message reaches the
+    # client exactly once: either in the history queued here or live afterwards
+    with history_lock:
+        client_info['username'] = username
+        clients.append(client_info)
+        send_json(client_info, {'response': 'login_success', 'epoch': epoch})
+        if isinstance(after, int):
+            if client_epoch != epoch:
+                after = 0  # The client's seqs are from another history, send it ours from the start
+            client_info['acked'] = after
+            # Only the messages the client hasn't seen yet
+            start = max(after, len(history) - SYNC_LIMIT, 0)
+            send_json(client_info, {'type': 'history', 'messages': history[start:]})
+
 def client_handler(client_socket, address, gui_signal):
     global clients, user_data
     username = None  # Initialize username to None
+    # Other threads queue frames for this client and wake its thread to send them
+    wakeup_reader, wakeup = socket.socketpair()
+    wakeup.setblocking(False)
+    # 'acked' is the highest seq the client confirmed receiving
+    client_info = {'client': client_socket, 'address': address, 'username': None, 'acked': 0,
+                   'message_queue': queue.Queue(SEND_QUEUE_LIMIT), 'wakeup': wakeup, 'wakeup_reader': wakeup_reader}
 
     try:
-        while True:
-            # Receive data from the client
-            data = client_socket.recv(1024).decode()
-            if not data:
-                break
+        if isinstance(client_socket, ssl.SSLSocket):
+            # The handshake runs here instead of in the accept loop
+            resumed = server_handshake(client_socket, tls_metrics)
+            gui_signal.signal.emit(f"TLS {'resumed' if resumed else 'full'} handshake with {address}. {tls_metrics.summary()}")
 
+        # Receive data from the client until it disconnects
+        for data in read_frames(client_info):
             # Process data (authentication, message broadcasting, etc.)
-            data = json.loads(data)
             action = data.get('action')
 
+            # Acks are cumulative and may come on their own or with a message
+            if client_info['username'] and isinstance(data.get('ack'), int):
+                client_info['acked'] = max(client_info['acked'], data['ack'])
+            if action == 'ack':
+                continue
+
             if action == 'login':
                 username = data.get('username')
                 password = data.get('password')
@@ -88,19 +218,16 @@ def client_handler(client_socket, address, gui_signal):
                     # User exists, check password
                     if user_data[username]['password'] == password:
                         # Successful login
-                        client_info = {'client': client_socket, 'address': address, 'username': username}
-                        clients.append(client_info)
+                        add_client(client_info, username, data.get('after'), data.get('epoch'))
                         gui_signal.signal.emit(f"User {username} authenticated successfully.")
-                        client_socket.send(json.dumps({'response': 'login_success'}).encode())
                     else:
                         # Incorrect password for existing user
-                        client_socket.send(json.dumps({'response': 'authentication_failed'}).encode())
+                        send_json(client_info, {'response': 'authentication_failed'})
                 else:
                     # Username does not exist, create new user
                     user_data[username] = {'password': password}
-                    clients.append({'client': client_socket, 'address': address, 'username': username})
+                    add_client(client_info, username, data.get('after'), data.get('epoch'))
                     gui_signal.signal.emit(f"New user {username} created and authenticated successfully.")
-                    client_socket.send(json.dumps({'response': 'login_success'}).encode())
 
                     # Update credentials file with new user
                     with open('credentials.json', 'w') as file:
@@ -115,31 +242,33 @@ def client_handler(client_socket, address, gui_signal):
                     with open('credentials.json', 'w') as file:
                         json.dump(user_data, file, indent=4)
                     gui_signal.signal.emit(f"New user {new_username} registered.")
-                    client_socket.send(json.dumps({'response': 'registration_success'}).encode())
+                    send_json(client_info, {'response': 'registration_success'})
                     
                     # Send welcome message
-                    welcome_message = json.dumps({
+                    welcome_message = {
                         'type': 'chat',
                         'sender': 'Server',
                         'message': f'Welcome {new_username} to the chat!',
                         'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    })
-                    client_socket.send(welcome_message.encode())
+                    }
+                    send_json(client_info, welcome_message)
                 else:
-                    client_socket.send(json.dumps({'response': 'registration_failed', 'reason': 'Username already exists'}).encode())
+                    send_json(client_info, {'response': 'registration_failed', 'reason': 'Username already exists'})
 
             elif action == 'message' and username:
                 message = data.get('message')
                 timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                broadcast_message = json.dumps({'type': 'chat', 'sender': username, 'message': message, 'timestamp': timestamp})
-
-                for client in clients:
-                    try:
-                        client['client'].send(broadcast_message.encode())
-                        print(f"Sent message to {client['username']}")
-                    except Exception as e:
-                        print(f"Failed to send message to {client['username']} at {client['address']}: {e}")
 
+                with history_lock:
+                    # Clients remember the last seq they saw and ask for what came after it
+                    chat_message = {'type': 'chat', 'seq': len(history) + 1, 'sender': username, 'message': message, 'timestamp': timestamp}
+                    history.append(chat_message)
+                    append_history(chat_message)
+                    # Serialize once and queue the same frame for every client, the
+                    # writer threads send it after the lock is released
+                    broadcast_message = encode_frame(chat_message)
+                    for client in clients:
+                        queue_frame(client, broadcast_message)
 
                 gui_signal.signal.emit(f"Message from {username}: {message}")
 
@@ -148,31 +277,31 @@ def client_handler(client_socket, address, gui_signal):
     finally:
         if username:
             gui_signal.signal.emit(f"{username} has disconnected.")
-            clients = [client for client in clients if client['client'] != client_socket]
+            with history_lock:
+                clients = [client for client in clients if client['client'] != client_socket]
         client_socket.close()
-        
-        
-def handle_client_messages(client_info):
-    while True:
-        for message in list(client_info['message_queue']):
-            try:
-                client_info['client'].send(json.dumps(message).encode())
-                # Consider adding logic to mark messages as sent but not yet acknowledged
-            except Exception as e:
-                print(f"Failed to send message to {client_info['username']} at {client_info['address']}: {e}")
-        time.sleep(1)
+        wakeup.close()
+        wakeup_reader.close()
 
 
 def start_server(gui_signal):
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.bind(('127.0.0.1', 12345))
     server.listen(5)
-    gui_signal.signal.emit("Server started and listening...")
+    tls_context = None
+    if USE_TLS:
+        tls_context = create_server_context(*load_or_create_certificate())
+        gui_signal.signal.emit("Server started with TLS and listening...")
+    else:
+        gui_signal.signal.emit("Server started and listening...")
 
     try:
         while True:
             client_socket, address = server.accept()
             gui_signal.signal.emit(f"Connection from {address}")
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if tls_context:
+                client_socket = tls_context.wrap_socket(client_socket, server_side=True, do_handshake_on_connect=False)
             threading.Thread(target=client_handler, args=(client_socket, address, gui_signal)).start()
     except Exception as e:
         gui_signal.signal.emit(f"Server error: {e}")
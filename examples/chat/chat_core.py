@@ -0,0 +1,258 @@
+import sys
+import json
+import random
+import asyncio
+import collections
+
+
+MAX_OFFLINE_MESSAGES = 500  # Messages kept while disconnected, the oldest are dropped first
+RECONNECT_BASE_DELAY = 0.5  # Seconds, doubled after every failed attempt
+RECONNECT_MAX_DELAY = 30.0
+ACK_DELAY = 0.2  # Seconds to wait so one ack covers a burst of messages
+ACK_EVERY = 100  # Ack right away once this many messages are unacknowledged
+
+
+def encode_frame(data):
+    # Every message is one line of JSON so the receiver can split a stream back into messages
+    return (json.dumps(data) + '\n').encode()
+
+
+class ChatCore:
+    # The chat protocol without any networking or GUI. A transport calls connection_made,
+    # feed and connection_lost, the core calls the handlers registered with on().
+    # call_later(delay, callback) is the transport's timer, used to delay acks.
+    def __init__(self, username=None, password=None, last_seq=0, epoch=None, max_outbox=MAX_OFFLINE_MESSAGES,
+                 call_later=None):
+        self.username = username
+        self.password = password
+        self.last_seq = last_seq  # Highest chat seq seen, sent at login to get only missed messages
+        self.epoch = epoch  # The server history last_seq counts in
+        self.acked_seq = last_seq  # Highest seq the server knows we have
+        self.ack_scheduled = False
+        self.call_later = call_later
+        self.outbox = collections.deque(maxlen=max_outbox)  # Messages not yet sent
+        self.handlers = collections.defaultdict(list)
+        self.buffer = b''  # Holds a partial message until its newline arrives
+        self.write = None  # Set by the transport while connected
+        self.logged_in = False
+        self.reconnect_attempts = 0
+
+    def on(self, message_type, handler=None):
+        # Message types: 'chat', 'system', 'notification', 'error', 'login', 'auth_failed'
+        # and 'epoch' (the server started a new history, cached messages no longer apply).
+        # Can also be used as a decorator: @core.on('chat')
+        if handler is None:
+            return lambda handler: self.on(message_type, handler)
+        self.handlers[message_type].append(handler)
+        return handler
+
+    def emit(self, message_type, message_data):
+        for handler in self.handlers[message_type]:
+            handler(message_data)
+
+    # ---------------- Transport callbacks ----------------
+
+    def connection_made(self, write):
+        self.write = write
+        self.buffer = b''
+        self.logged_in = False
+        # The login's 'after' already tells the server what we have
+        self.acked_seq = self.last_seq
+        # 'after' asks the server for the messages we missed since the last one we saw
+        self.send_frame({'action': 'login', 'username': self.username, 'password': self.password,
+                         'after': self.last_seq, 'epoch': self.epoch})
+
+    def connection_lost(self):
+        self.write = None
+        self.logged_in = False
+
+    def feed(self, data):
+        # A read may hold several messages or only part of one
+        self.buffer += data
+        *frames, self.buffer = self.buffer.split(b'\n')
+        for frame in frames:
+            if not frame.strip():
+                continue
+            try:
+                message_data = json.loads(frame)
+            except ValueError as e:
+                print(f"Error decoding message: {e}")
+                continue
+            self.handle_message(message_data)
+        # One check per read, so a burst of messages leads to a single ack
+        self.schedule_ack()
+
+    def next_reconnect_delay(self):
+        # Exponential backoff with full jitter so clients don't all come back at the same moment
+        ceiling = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** self.reconnect_attempts)
+        self.reconnect_attempts += 1
+        return random.uniform(0, ceiling)
+
+    # ---------------- Incoming ----------------
+
+    def handle_message(self, message_data):
+        # Handle non-chat type messages like authentication responses
+        if 'response' in message_data:
+            if message_data['response'] == 'login_success':
+                if message_data.get('epoch') != self.epoch:
+                    # The server sends its history from the start, seqs begin at 1 again
+                    self.epoch = message_data.get('epoch')
+                    self.last_seq = self.acked_seq = 0
+                    self.emit('epoch', message_data)
+                self.logged_in = True
+                self.reconnect_attempts = 0
+                self.flush_outbox()
+                self.emit('login', message_data)
+            elif message_data['response'] == 'authentication_failed':
+                self.emit('auth_failed', message_data)
+            return
+
+        message_type = message_data.get('type')
+        if message_type == 'chat':
+            self.handle_chat_message(message_data)
+        elif message_type == 'history':
+            for chat_message in message_data.get('messages', []):
+                self.handle_chat_message(chat_message)
+        elif message_type in ('system', 'notification', 'error'):
+            self.emit(message_type, message_data)
+        else:
+            print(f"Unknown message type: {message_type}")
+
+    def handle_chat_message(self, message_data):
+        seq = message_data.get('seq')
+        if seq is not None:
+            if seq <= self.last_seq:
+                return  # Already seen
+            self.last_seq = seq
+        self.emit('chat', message_data)
+
+    # ---------------- Outgoing ----------------
+
+    def send_frame(self, data):
+        if self.write:
+            self.write(encode_frame(data))
+
+    def send_message(self, message):
+        # Returns False when the outbox was full and the oldest unsent message was dropped
+        dropped = len(self.outbox) == self.outbox.maxlen
+        self.outbox.append({'action': 'message', 'message': message})
+        self.flush_outbox()
+        return not dropped
+
+    def flush_outbox(self):
+        # Everything queued goes out in a single write, without waiting for replies
+        if self.logged_in and self.write and self.outbox:
+            frames = list(self.outbox)
+            self.outbox.clear()
+            if self.last_seq > self.acked_seq:
+                # Piggyback the pending ack on the last message instead of sending its own frame
+                frames[-1] = dict(frames[-1], ack=self.last_seq)
+                self.acked_seq = self.last_seq
+            self.write(b''.join(encode_frame(frame) for frame in frames))
+
+    # ---------------- Acknowledgements ----------------
+
+    def schedule_ack(self):
+        # Acks are cumulative: one ack covers every message up to last_seq
+        unacked = self.last_seq - self.acked_seq
+        if unacked <= 0 or not self.logged_in:
+            return
+        if unacked >= ACK_EVERY or self.call_later is None:
+            self.send_ack()
+        elif not self.ack_scheduled:
+            self.ack_scheduled = True
+            self.call_later(ACK_DELAY, self.send_ack)
+
+    def send_ack(self):
+        self.ack_scheduled = False
+        # Nothing to do if the ack already went out with a message
+        if self.logged_in and self.last_seq > self.acked_seq:
+            self.send_frame({'action': 'ack', 'ack': self.last_seq})
+            self.acked_seq = self.last_seq
+
+
+class _CoreProtocol(asyncio.Protocol):
+    def __init__(self, core, closed):
+        self.core = core
+        self.closed = closed
+
+    def connection_made(self, transport):
+        self.core.connection_made(transport.write)
+
+    def data_received(self, data):
+        self.core.feed(data)
+
+    def connection_lost(self, exc):
+        self.core.connection_lost()
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+
+class AsyncChatClient(ChatCore):
+    # Headless client for bots, one event loop can drive hundreds of these
+    def __init__(self, host, port, username, password, ssl_context=None, **kwargs):
+        super().__init__(username, password, **kwargs)
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.transport = None
+        self.closing = False
+
+    async def run(self):
+        # Stays connected until close() is called, reconnecting with backoff
+        loop = asyncio.get_running_loop()
+        self.call_later = loop.call_later
+        while not self.closing:
+            closed = loop.create_future()
+            try:
+                self.transport, _ = await loop.create_connection(
+                    lambda: _CoreProtocol(self, closed), self.host, self.port, ssl=self.ssl_context,
+                    # The generated certificate is issued for localhost
+                    server_hostname='localhost' if self.ssl_context else None)
+                await closed
+            except OSError as e:
+                print(f"{self.username}: connection error: {e}")
+            self.transport = None
+            if not self.closing:
+                await asyncio.sleep(self.next_reconnect_delay())
+
+    def close(self):
+        self.closing = True
+        if self.transport:
+            self.transport.close()
+
+
+async def run_bots(host, port, count, ssl_context=None):
+    # Example: connect many bots that count the messages they receive
+    received = collections.Counter()
+    bots = []
+    for i in range(count):
+        bot = AsyncChatClient(host, port, f'bot{i}', f'bot{i}', ssl_context)
+        bot.on('chat', lambda message_data, name=bot.username: received.update([name]))
+        bots.append(bot)
+    bots[0].on('login', lambda _: bots[0].send_message(f'{count} bots online'))
+
+    tasks = [asyncio.create_task(bot.run()) for bot in bots]
+    try:
+        while True:
+            await asyncio.sleep(5)
+            online = sum(bot.logged_in for bot in bots)
+            print(f"{online}/{count} bots logged in, {sum(received.values())} messages received")
+    finally:
+        for bot in bots:
+            bot.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+if __name__ == '__main__':
+    # Usage: python chat_core.py [number of bots] [--tls]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    count = int(args[0]) if args else 100
+    ssl_context = None
+    if '--tls' in sys.argv:
+        from chat_tls import create_client_context
+        ssl_context = create_client_context()
+    try:
+        asyncio.run(run_bots('127.0.0.1', 12345, count, ssl_context))
+    except KeyboardInterrupt:
+        pass
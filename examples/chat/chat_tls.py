@@ -0,0 +1,164 @@
+import os
+import ssl
+import sys
+import socket
+import threading
+import subprocess
+import time
+
+
+CERT_FILE = 'server.crt'
+KEY_FILE = 'server.key'
+
+
+def load_or_create_certificate(cert_file=CERT_FILE, key_file=KEY_FILE):
+    # Generate a self-signed certificate for local use the first time the server runs.
+    # An EC key keeps full handshakes cheap compared to RSA.
+    if not (os.path.exists(cert_file) and os.path.exists(key_file)):
+        subprocess.run([
+            'openssl', 'req', '-x509', '-nodes', '-days', '365',
+            '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+            '-subj', '/CN=localhost',
+            '-addext', 'subjectAltName=IP:127.0.0.1,DNS:localhost',
+            '-keyout', key_file, '-out', cert_file
+        ], check=True, capture_output=True)
+    return cert_file, key_file
+
+
+def create_server_context(cert_file=CERT_FILE, key_file=KEY_FILE):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(cert_file, key_file)
+    # Session tickets let returning clients skip the full handshake
+    context.options &= ~ssl.OP_NO_TICKET
+    context.num_tickets = 2
+    return context
+
+
+def create_client_context(cert_file=CERT_FILE):
+    # Trust only the locally generated server certificate
+    context = ssl.create_default_context(cafile=cert_file)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    return context
+
+
+class HandshakeMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.full = 0
+        self.resumed = 0
+        self.failed = 0
+        self.full_time = 0.0
+        self.resumed_time = 0.0
+
+    def record(self, resumed, duration):
+        with self.lock:
+            if resumed:
+                self.resumed += 1
+                self.resumed_time += duration
+            else:
+                self.full += 1
+                self.full_time += duration
+
+    def record_failure(self):
+        with self.lock:
+            self.failed += 1
+
+    def summary(self):
+        with self.lock:
+            full_avg = self.full_time / self.full * 1000 if self.full else 0.0
+            resumed_avg = self.resumed_time / self.resumed * 1000 if self.resumed else 0.0
+            return (f"TLS handshakes: {self.full} full (avg {full_avg:.2f} ms), "
+                    f"{self.resumed} resumed (avg {resumed_avg:.2f} ms), {self.failed} failed")
+
+
+def server_handshake(tls_socket, metrics, timeout=10):
+    # Runs on the client handler thread so a slow handshake never blocks accept()
+    tls_socket.settimeout(timeout)
+    start = time.perf_counter()
+    try:
+        tls_socket.do_handshake()
+    except (ssl.SSLError, OSError):
+        metrics.record_failure()
+        raise
+    resumed = tls_socket.session_reused
+    metrics.record(resumed, time.perf_counter() - start)
+    tls_socket.settimeout(None)
+    return resumed
+
+
+# ---------------- Benchmark ----------------
+
+def _benchmark_server(server, context, metrics):
+    def handle(client_socket):
+        try:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            tls_socket = context.wrap_socket(client_socket, server_side=True, do_handshake_on_connect=False)
+            server_handshake(tls_socket, metrics)
+            # Send a byte so the client also reads the session tickets that follow the handshake
+            tls_socket.sendall(b'k')
+            tls_socket.recv(1)
+            tls_socket.close()
+        except (ssl.SSLError, OSError):
+            client_socket.close()
+
+    while True:
+        try:
+            client_socket, _ = server.accept()
+        except OSError:
+            break
+        threading.Thread(target=handle, args=(client_socket,), daemon=True).start()
+
+
+def _connect(port, context, session=None):
+    raw = socket.create_connection(('127.0.0.1', port))
+    raw.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    tls_socket = context.wrap_socket(raw, server_hostname='127.0.0.1', session=session)
+    tls_socket.recv(1)
+    session = tls_socket.session
+    resumed = tls_socket.session_reused
+    tls_socket.sendall(b'k')
+    tls_socket.close()
+    return session, resumed
+
+
+def run_benchmark(rounds=200, tls_version=None):
+    cert_file, key_file = load_or_create_certificate()
+    server_context = create_server_context(cert_file, key_file)
+    client_context = create_client_context(cert_file)
+    if tls_version is not None:
+        client_context.maximum_version = tls_version
+    metrics = HandshakeMetrics()
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(128)
+    port = server.getsockname()[1]
+    threading.Thread(target=_benchmark_server, args=(server, server_context, metrics), daemon=True).start()
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        _connect(port, client_context)
+    full_rate = rounds / (time.perf_counter() - start)
+
+    session, _ = _connect(port, client_context)
+    reused = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        session, resumed = _connect(port, client_context, session)
+        reused += resumed
+    resumed_rate = rounds / (time.perf_counter() - start)
+
+    server.close()
+    print(f"Full handshakes:    {full_rate:8.1f} connections/s")
+    print(f"Resumed handshakes: {resumed_rate:8.1f} connections/s ({reused}/{rounds} resumed)")
+    print(f"Speedup: {resumed_rate / full_rate:.2f}x")
+    print(metrics.summary())
+
+
+if __name__ == '__main__':
+    # Usage: python chat_tls.py [rounds] [--tls1.2]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    rounds = int(args[0]) if args else 200
+    version = ssl.TLSVersion.TLSv1_2 if '--tls1.2' in sys.argv else None
+    run_benchmark(rounds, version)
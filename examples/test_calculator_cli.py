@@ -0,0 +1,28 @@
+import io
+import sys
+import json
+import unittest
+
+import calculator_cli
+
+TOO_LONG = f"Result has more than {sys.get_int_max_str_digits()} digits"
+
+class RunBatchTest(unittest.TestCase):
+    def run_lines(self, lines, output_format="jsonl"):
+        output = io.StringIO()
+        counts = calculator_cli.run_batch(lines, output, output_format, workers=1)
+        return counts, output.getvalue()
+
+    def test_unwritable_result_is_an_item_error(self):
+        counts, output = self.run_lines(["1+1", "factorial(2000)", "3"])
+        rows = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual([(row["status"], row["result"]) for row in rows],
+                         [("ok", 2), ("error", TOO_LONG), ("ok", 3)])
+        self.assertEqual(counts, {"ok": 2, "error": 1})
+
+    def test_csv(self):
+        _, output = self.run_lines(["1+1", "factorial(2000)"], "csv")
+        self.assertEqual(output.splitlines()[1:], ["1,1+1,ok,2", f"2,factorial(2000),error,{TOO_LONG}"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import calculator_engine as engine
+
+class FoldConstantsTest(unittest.TestCase):
+    def setUp(self):
+        self.x = np.arange(-2.0, 3.0)
+
+    def test_negative_base_to_a_power(self):
+        expected = [-0.5, np.nan, 1.0, np.nan, -2.0]
+        with np.errstate(all="ignore"):
+            np.testing.assert_array_equal(engine.evaluate_graph("(-2)^(x/2)", self.x), expected)
+            np.testing.assert_array_equal(engine.evaluate_graph_batch(["(-2)^(x/2)", "x"], self.x)[0], expected)
+            _, y = engine.ParametricExpression("(-2)^(a*x)").evaluate(-2, 2, {"a": 0.5}, num_points=5)
+        np.testing.assert_array_equal(y, expected)
+
+    def test_folded_constants_keep_numpy_semantics(self):
+        with np.errstate(all="ignore"):
+            np.testing.assert_array_equal(engine.evaluate_graph("x + 1/sin(0)", self.x), np.inf)
+            self.assertTrue(np.isnan(engine.evaluate_graph_chunked("cos(3)^0.5*x", self.x)).all())
+
+class FastWrongBackend:
+    # Beats NumPy on any probe, but computes the wrong function
+    name = "fast_wrong"
+
+    def available(self):
+        return True
+
+    def supports(self, expression, parameters=()):
+        return True
+
+    def kernel(self, expression, parameters=()):
+        return lambda x, out, *values: out.fill(0.0)
+
+class GraphKernelsTest(unittest.TestCase):
+    def test_reserved_names_are_not_parameters(self):
+        self.assertEqual(engine.free_parameters("sin(i*x) + _x + _i"), ("i",))
+
+    @unittest.skipUnless(engine.GRAPH_BACKENDS["numba"].available(), "numba is not installed")
+    def test_numba_kernel_parameter_names(self):
+        x = np.linspace(-3, 3, 7)
+        kernels = engine.GraphKernels(backend="numba")
+        out = np.empty_like(x)
+        kernels.jit_kernel("sin(i*x) + out + (-2)^x", ("i", "out"))(x, out, 2.0, 1.0)
+        with np.errstate(all="ignore"):
+            np.testing.assert_allclose(out, np.sin(2 * x) + 1 + np.power(-2.0, x), equal_nan=True)
+
+    def test_wrong_kernel_is_not_adopted(self):
+        backends = {"numpy": engine.GRAPH_BACKENDS["numpy"], "fast_wrong": FastWrongBackend()}
+        with mock.patch.dict(engine.GRAPH_BACKENDS, backends, clear=True):
+            kernels = engine.GraphKernels()
+            kernels.compile(("sin(x)", ()))
+        self.assertIsNone(kernels.compiled[("sin(x)", ())])
+
+    def test_tables_are_bounded(self):
+        kernels = engine.GraphKernels(max_size=2)
+        for expression in ("x", "x+1", "x+2"):
+            kernels.jit_kernel(expression, points=1)
+        self.assertEqual(list(kernels.points), [("x+1", ()), ("x+2", ())])
+
+class ImplicitCurveTest(unittest.TestCase):
+    def test_poles_are_not_drawn(self):
+        for equation, function in (("y=1/(x-0.3)", lambda x: 1 / (x - 0.3)), ("y=tan(x)", np.tan)):
+            segments = engine.implicit_curve(equation, (-10, 10), (-10, 10), 800)
+            middle = segments.mean(axis=1)
+            self.assertLess(np.abs(middle[:, 1] - function(middle[:, 0])).max(), 0.5, equation)
+
+    def test_same_curve_however_written(self):
+        self.assertEqual(len(engine.implicit_curve("y=1/(x-0.3)", (-10, 10), (-10, 10), 800)),
+                         len(engine.implicit_curve("y*(x-0.3)=1", (-10, 10), (-10, 10), 800)))
+
+class IntegrateNumericTest(unittest.TestCase):
+    def test_fast_oscillation_is_refined(self):
+        integral, error, _ = engine.integrate_numeric("sin(100*x)**2", -10, 10)
+        self.assertAlmostEqual(integral, 10 - np.sin(2000) / 200, places=9)
+        self.assertLess(error, 1e-9)
+
+    def test_undefined_integrand(self):
+        integral, error, _ = engine.integrate_numeric("log(x)", -1, 1)
+        self.assertTrue(np.isnan(integral) and np.isnan(error))
+
+if __name__ == "__main__":
+    unittest.main()